@@ -0,0 +1,114 @@
+"""
+End to end benchmark of the scrape pipeline against the local Google Maps stand-in
+(benchmarks/maps_server.py), so runs are repeatable and never touch the live site.
+
+    python3 benchmarks/bench_pipeline.py --threads 1,2,4 --reviews 50,200 --businesses 8
+
+Each combination of worker threads and reviews per business scrapes the same number
+of businesses through the real SessionPool and scrape_business, then reports the
+throughput and the p50/p90/p99 time per business. Every business is searched, followed
+to its place page and stored in a fresh place cache, as in a first run. With --recordings
+the stand-in serves saved pages for the searches it has them for.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from maps_server import MapsStandIn, start_server  # noqa: E402
+
+# main reads its settings when imported, so the stand-in is started and G_MAPS_URL pointed at it first
+stand_in = MapsStandIn()
+server = start_server(stand_in)
+os.environ['G_MAPS_URL'] = f"http://127.0.0.1:{server.server_address[1]}/maps?q="
+os.environ.setdefault('G_MAP_THREADS', "4")
+os.environ.setdefault('G_MAPS_LOG_NAME', os.path.join(tempfile.gettempdir(), "bench_pipeline.log"))
+os.environ.setdefault('G_MAPS_LOG_SIZE', "10000000")
+os.environ.setdefault('G_MAPS_LOG_COUNT', "1")
+os.environ.setdefault('G_MAPS_LOG_DEBUG', "False")
+
+from main import scrape_business  # noqa: E402
+from gmaps.metrics import MetricsWriter, percentile  # noqa: E402
+from gmaps.places import PlaceCache  # noqa: E402
+from gmaps.session import SessionPool  # noqa: E402
+
+
+def run(driver_path: str, threads: int, reviews: int, businesses: int) -> dict:
+    """ Scrapes businesses from the stand-in with the given number of worker threads """
+    stand_in.reviews = reviews
+    targets = [f"bench{index},Benchmark Business {index} Testville" for index in range(businesses)]
+
+    metrics_file = os.path.join(tempfile.gettempdir(), f"bench_pipeline_{threads}_{reviews}.jsonl")
+    place_cache_file = os.path.join(tempfile.gettempdir(), f"bench_pipeline_{threads}_{reviews}_places.sqlite")
+    if os.path.exists(place_cache_file):
+        os.remove(place_cache_file)
+    review_rows = 0
+    failures = 0
+    start_time = perf_counter()
+    with MetricsWriter(metrics_file) as metrics_writer, \
+            PlaceCache(place_cache_file) as place_cache, \
+            SessionPool(driver_path, threads) as session_pool, \
+            ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(scrape_business, target, session_pool, None, metrics_writer, None, place_cache)
+                   for target in targets]
+        for future in futures:
+            try:
+                review_rows += len(future.result()[2])
+            except Exception:
+                failures += 1
+    elapsed = perf_counter() - start_time
+
+    with open(metrics_file, encoding="utf-8") as metrics_lines:
+        business_seconds = sorted(json.loads(line)['total_seconds'] for line in metrics_lines)
+
+    return {
+        'threads': threads,
+        'reviews': reviews,
+        'businesses_per_min': round(businesses / elapsed * 60, 1),
+        'reviews_per_sec': round(review_rows / elapsed, 1),
+        'p50': percentile(business_seconds, 50),
+        'p90': percentile(business_seconds, 90),
+        'p99': percentile(business_seconds, 99),
+        'failures': failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrape pipeline against a local Google Maps stand-in")
+    parser.add_argument("--threads", default="1,2,4", help="comma separated worker thread counts")
+    parser.add_argument("--reviews", default="50,200", help="comma separated reviews per business")
+    parser.add_argument("--businesses", type=int, default=8, help="businesses scraped per combination")
+    parser.add_argument("--latency", type=int, default=100, help="ms to load each page of reviews")
+    parser.add_argument("--page-latency", type=int, default=0, help="ms to serve each place page")
+    parser.add_argument("--recordings", help="directory of saved pages served in place of synthetic ones")
+    parser.add_argument("--driver", help="path to chromedriver, installed with webdriver-manager when omitted")
+    args = parser.parse_args()
+
+    stand_in.latency = args.latency
+    stand_in.page_latency = args.page_latency
+    stand_in.recordings = args.recordings
+    if args.driver:
+        driver_path = args.driver
+    else:
+        from webdriver_manager.chrome import ChromeDriverManager
+        driver_path = ChromeDriverManager().install()
+
+    print(f"{'threads':>7} {'reviews':>7} {'biz/min':>8} {'reviews/s':>9} {'p50 s':>7} {'p90 s':>7} {'p99 s':>7} "
+          f"{'failed':>6}")
+    for reviews in [int(value) for value in args.reviews.split(",")]:
+        for threads in [int(value) for value in args.threads.split(",")]:
+            result = run(driver_path, threads, reviews, args.businesses)
+            print(f"{result['threads']:>7} {result['reviews']:>7} {result['businesses_per_min']:>8} "
+                  f"{result['reviews_per_sec']:>9} {str(result['p50']):>7} {str(result['p90']):>7} "
+                  f"{str(result['p99']):>7} {result['failures']:>6}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the per item review parsing path with the bulk single pass path
+against saved review feed HTML.
+
+    python3 benchmarks/bench_review_parse.py --reviews 1000
+    python3 benchmarks/bench_review_parse.py saved_feed_1.html saved_feed_2.html
+
+The review items found in the fixtures are repeated until the feed holds the
+requested number of reviews. The WebDriver round-trip saved per review by the
+bulk path is not included, this only measures the parsing cost.
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from gmaps.parse import REVIEW_ITEM_SELECTOR, new_review_dict, parse_review_feed, parse_review_item
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "review_feed.html")
+
+
+def load_items(fixture_paths: list, review_total: int) -> list:
+    items = []
+    for path in fixture_paths:
+        with open(path, encoding="utf-8") as fixture:
+            items.extend(str(item) for item in BeautifulSoup(fixture.read(), 'html.parser').select(REVIEW_ITEM_SELECTOR))
+
+    if not items:
+        raise SystemExit("No review items found in the fixtures")
+
+    return [items[i % len(items)] for i in range(review_total)]
+
+
+def run_per_item(html_items: list) -> dict:
+    rev_dict = new_review_dict()
+    for html_item in html_items:
+        parse_review_item(html_item, "bench", rev_dict)
+    return rev_dict
+
+
+def run_bulk(feed_html: str) -> dict:
+    return parse_review_feed(feed_html, "bench")
+
+
+def best_of(repeat: int, func, *args):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func(*args)
+        timings.append(perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark review parsing")
+    parser.add_argument("fixtures", nargs="*", default=[DEFAULT_FIXTURE], help="saved review feed HTML files")
+    parser.add_argument("--reviews", type=int, default=1000, help="number of reviews in the feed")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs, the best is reported")
+    args = parser.parse_args()
+
+    html_items = load_items(args.fixtures, args.reviews)
+    feed_html = '<div class="m6QErb">' + "".join(html_items) + '</div>'
+
+    per_item_time, per_item_result = best_of(args.repeat, run_per_item, html_items)
+    bulk_time, bulk_result = best_of(args.repeat, run_bulk, feed_html)
+
+    if per_item_result != bulk_result:
+        raise SystemExit("Per item and bulk parsing returned different reviews")
+
+    print(f"reviews:           {len(bulk_result['review'])}")
+    print(f"per item (html.parser per review): {per_item_time * 1000:9.1f} ms")
+    print(f"bulk (one lxml pass):              {bulk_time * 1000:9.1f} ms")
+    print(f"speed up:                          {per_item_time / bulk_time:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+Local stand-in for Google Maps place pages, so the scraper can be benchmarked
+without hitting the live site.
+
+    python3 benchmarks/maps_server.py --port 8765 --reviews 200 --latency 150
+    G_MAPS_URL="http://127.0.0.1:8765/maps?q=" python3 main.py input.csv bench
+
+Like Google maps, a search redirects to the place's own URL, /maps/place/[query],
+which serves a synthetic place page with the elements the extractors read: the
+summary panel, popular times for seven days and a review feed that loads
+--page-size reviews at a time after --latency ms as it is scrolled. A search
+containing "nomatch" returns a page saying nothing was found instead, and a
+search containing "reviews:N" overrides the number of reviews for that place.
+
+With --recordings, a saved page named after the search (lower case, spaces as
+underscores, .html) is served instead of the synthetic one when it exists.
+"""
+import argparse
+import html
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+SERVICE_OPTIONS = ["Offers in-store shopping", "Offers curbside pickup", "Has wheelchair accessible entrance"]
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{name} - Google Maps</title>
+<style>
+  body {{ margin: 0; font-family: sans-serif; }}
+  #QA0Szd {{ width: 420px; }}
+  .feed {{ height: 600px; overflow-y: auto; }}
+  .hidden {{ display: none; }}
+  .jftiEf {{ padding: 12px; min-height: 80px; border-bottom: 1px solid #ddd; }}
+  .lXJj5c {{ height: 40px; }}
+  .dpoVLd {{ display: inline-block; width: 8px; background: #88a; }}
+</style>
+</head>
+<body>
+<input id="searchboxinput" value="{query}">
+<div id="QA0Szd"><div><div><div role="main" aria-label="{name}">
+  <div class="header">
+    <div class="tAiQdd"><h1 class="DUwDvf">{name}</h1></div>
+    <div class="F7nice"><span aria-hidden="true">{rating}</span><span class="ceNzKf" role="img" aria-label="{rating} stars "></span><span><span aria-label="{review_total} reviews">({review_total_text})</span></span></div>
+    <div class="RWPxGd" role="tablist">
+      <button role="tab" aria-label="Overview of {name}" data-tab="overview">Overview</button>
+      <button role="tab" aria-label="Reviews for {name}" data-tab="reviews">Reviews</button>
+    </div>
+  </div>
+  <div>
+    <div>
+      <div class="reviews-section hidden">
+        <div>
+          <div>
+            <div class="reviews-header">
+              <div class="jANrlb"><div>{rating}</div><div>{review_total_text} reviews</div></div>
+              <div role="radiogroup"><button aria-label="Sort reviews">Sort</button></div>
+              <div class="sort-menu hidden">
+                <div role="menuitemradio" data-index="0">Most relevant</div>
+                <div role="menuitemradio" data-index="1">Newest</div>
+              </div>
+            </div>
+            <div class="feed m6QErb" tabindex="-1"></div>
+          </div>
+        </div>
+      </div>
+      <div class="overview-section">
+        <button aria-label="Address: {address} "><div>{address}</div></button>
+        {service_options}
+        <h2>Photos</h2>
+        <div><h2>Popular times</h2><div class="C7xf8b">{popular_times}</div></div>
+      </div>
+    </div>
+  </div>
+</div></div></div></div>
+<script>
+const config = {config};
+const names = ["Sarah Mitchell", "Tom Alvarez", "Priya N", "Marcus Lee", "Ana Costa", "Wei Zhang", "Olu Ade"];
+const ages = ["a day ago", "3 days ago", "a week ago", "2 weeks ago", "a month ago", "3 months ago", "a year ago"];
+const sentence = "Good selection of stores and friendly staff, parking was easy on a weekday afternoon. ";
+const feed = document.querySelector('.feed');
+const fullText = {{}};
+let loaded = 0;
+let loading = false;
+let generation = 0;
+let loader = null;
+
+function reviewHtml(i) {{
+  const id = 'rev' + config.seed + '_' + (config.sorted ? 'n' : 'r') + i;
+  const long = i % 3 === 0;
+  const text = sentence.repeat(long ? 6 : 1).trim() + ' #' + i;
+  fullText[id] = text;
+  const shown = long ? text.slice(0, 120) + '…' : text;
+  const more = long ? '<button class="w8nwRe kyuRq" aria-expanded="false" aria-label="See more">More</button>' : '';
+  return '<div class="jftiEf fontBodyMedium " aria-label="' + names[i % names.length] + '" data-review-id="' + id + '">' +
+    '<div class="jJc9Ad "><div class="GHT2ce NsCY4 "><button class="al6Kxe"><div class="d4r55 ">' + names[i % names.length] +
+    '</div></button></div><div class="GHT2ce"><div class="DU9Pgb"><span class="kvMYJc" role="img" aria-label="' +
+    (1 + i % 5) + ' stars"></span><span class="rsqaWe">' + ages[i % ages.length] + '</span></div>' +
+    '<div class="MyEned" id="' + id + '"><span class="wiI7pd">' + shown + '</span> ' + more + '</div></div></div></div>';
+}}
+
+function loaderVisible() {{
+  if (!loader || !loader.isConnected) return false;
+  const box = loader.getBoundingClientRect();
+  const view = feed.getBoundingClientRect();
+  return box.top < view.bottom + 200;
+}}
+
+function loadPage() {{
+  if (loading || loaded >= config.reviews) return;
+  loading = true;
+  const pageGeneration = generation;
+  setTimeout(() => {{
+    if (pageGeneration !== generation) return;
+    const end = Math.min(loaded + config.pageSize, config.reviews);
+    let items = '';
+    for (let i = loaded; i < end; i++) items += reviewHtml(i);
+    loader.insertAdjacentHTML('beforebegin', items);
+    loaded = end;
+    loading = false;
+    if (loaded >= config.reviews) loader.remove();
+    else if (loaderVisible()) loadPage();
+  }}, config.latency);
+}}
+
+function resetFeed() {{
+  generation += 1;
+  loading = false;
+  loaded = 0;
+  feed.innerHTML = '<div class="lXJj5c Hk4XGb"><div class="qjESne"></div></div>';
+  loader = feed.querySelector('.lXJj5c');
+  if (config.reviews > 0) loadPage();
+  else loader.remove();
+}}
+
+feed.addEventListener('scroll', () => {{ if (loaderVisible()) loadPage(); }});
+// Catch a feed that stops overflowing, for example after the scraper prunes reviews
+setInterval(() => {{ if (loaderVisible()) loadPage(); }}, 100);
+
+feed.addEventListener('click', event => {{
+  const button = event.target.closest('.w8nwRe');
+  if (!button) return;
+  const container = button.closest('.MyEned');
+  setTimeout(() => {{
+    container.querySelector('.wiI7pd').textContent = fullText[container.id];
+    button.remove();
+  }}, 20);
+}});
+
+document.querySelectorAll('[role=tab]').forEach(tab => tab.addEventListener('click', () => {{
+  const reviews = tab.dataset.tab === 'reviews';
+  document.querySelector('.reviews-section').classList.toggle('hidden', !reviews);
+  document.querySelector('.overview-section').classList.toggle('hidden', reviews);
+  if (reviews && !loader) resetFeed();
+}}));
+
+document.querySelector('[aria-label="Sort reviews"]').addEventListener('click', () => {{
+  document.querySelector('.sort-menu').classList.remove('hidden');
+}});
+
+document.querySelectorAll('[role=menuitemradio]').forEach(item => item.addEventListener('click', () => {{
+  document.querySelector('.sort-menu').classList.add('hidden');
+  config.sorted = item.dataset.index === '1';
+  resetFeed();
+}}));
+</script>
+</body>
+</html>
+"""
+
+NO_MATCH_TEMPLATE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>Google Maps</title></head>
+<body><input id="searchboxinput" value="{query}"><div role="main"><p>Google Maps can't find {query}</p></div></body>
+</html>
+"""
+
+
+class MapsStandIn:
+    """ Settings shared by the request handlers """
+
+    def __init__(self, reviews: int = 100, latency: int = 100, page_size: int = 10, page_latency: int = 0,
+                 recordings: str = None):
+        self.reviews = reviews
+        self.latency = latency
+        self.page_size = page_size
+        self.page_latency = page_latency
+        self.recordings = recordings
+
+    def place_path(self, query: str) -> str:
+        """ The path a search redirects to, None for a search with no match """
+        return None if "nomatch" in query.lower() else "/maps/place/" + quote(query)
+
+    def page(self, query: str) -> str:
+        if self.recordings:
+            recording = os.path.join(self.recordings, re.sub(r"\s+", "_", query.strip().lower()) + ".html")
+            if os.path.exists(recording):
+                with open(recording, encoding="utf-8") as recorded:
+                    return recorded.read()
+
+        if "nomatch" in query.lower():
+            return NO_MATCH_TEMPLATE.format(query=html.escape(query))
+
+        review_override = re.search(r"reviews[:=](\d+)", query)
+        review_total = int(review_override.group(1)) if review_override else self.reviews
+        seed = sum(ord(character) for character in query)
+        rating = round(3 + (seed % 20) / 10, 1)
+        name = html.escape(query.split(" reviews")[0].strip() or "Benchmark Business")
+
+        config = {'reviews': review_total, 'latency': self.latency, 'pageSize': self.page_size, 'seed': seed,
+                  'sorted': False}
+        return PAGE_TEMPLATE.format(
+            name=name,
+            query=html.escape(query),
+            rating=rating,
+            review_total=review_total,
+            review_total_text=f"{review_total:,}",
+            address=f"{seed % 900 + 100} Benchmark Street, Testville, TS {seed % 90000 + 10000}",
+            service_options="".join(f'<div class="LTs0Rc" aria-label="{option}"></div>' for option in SERVICE_OPTIONS),
+            popular_times=popular_times_html(seed),
+            config=json.dumps(config),
+        )
+
+
+def popular_times_html(seed: int) -> str:
+    days = []
+    for day_index, day in enumerate(DAYS):
+        bars = []
+        for hour in range(6, 24):
+            percent = (seed * (day_index + 3) * (hour + 1)) % 100
+            hour_text = f"{hour if hour <= 12 else hour - 12} {'AM' if hour < 12 else 'PM'}"
+            bars.append(f'<div class="dpoVLd" aria-label="{percent}% busy at {hour_text}."></div>')
+        if day_index == seed % 7:
+            bars.insert(4, '<div class="dpoVLd" aria-label="Currently 35% busy, usually 50% busy."></div>')
+        days.append(f'<div class="g2BVhd" aria-label="Histogram showing popular times on {day}s">{"".join(bars)}</div>')
+    return "".join(days)
+
+
+def handler_for(stand_in: MapsStandIn):
+    class MapsRequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/maps":
+                query = parse_qs(url.query).get("q", [""])[0]
+                place_path = stand_in.place_path(query)
+                if place_path is not None:
+                    self.send_response(302)
+                    self.send_header("Location", place_path)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+            elif url.path.startswith("/maps/place/"):
+                query = unquote(url.path[len("/maps/place/"):])
+            else:
+                self.send_error(404)
+                return
+
+            if stand_in.page_latency:
+                sleep(stand_in.page_latency / 1000)
+
+            body = stand_in.page(query).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MapsRequestHandler
+
+
+def start_server(stand_in: MapsStandIn, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """ Starts the stand-in on a background thread, port 0 picks a free port """
+    server = ThreadingHTTPServer((host, port), handler_for(stand_in))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for Google Maps place pages")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reviews", type=int, default=100, help="reviews per place")
+    parser.add_argument("--page-size", type=int, default=10, help="reviews loaded per scroll")
+    parser.add_argument("--latency", type=int, default=100, help="ms to load each page of reviews")
+    parser.add_argument("--page-latency", type=int, default=0, help="ms to serve each place page")
+    parser.add_argument("--recordings", help="directory of saved pages served in place of synthetic ones")
+    args = parser.parse_args()
+
+    stand_in = MapsStandIn(args.reviews, args.latency, args.page_size, args.page_latency, args.recordings)
+    server = ThreadingHTTPServer((args.host, args.port), handler_for(stand_in))
+    print(f"Serving Google Maps stand-in, set G_MAPS_URL=http://{args.host}:{args.port}/maps?q=")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
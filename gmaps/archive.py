@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from time import time
+
+from gmaps.parse import new_review_dict, no_popular_times, parse_details, parse_popular_times, parse_review_feed
+
+ARCHIVE_VERSION = 2
+
+
+def archive_filename(directory: str, ref: str) -> str:
+    """ Returns the archive file of a business, refs that are not safe file names get a hash to keep them apart """
+    safe_ref = re.sub(r"[^\w.-]", "_", ref)
+    if safe_ref != ref:
+        safe_ref += "-" + hashlib.sha1(ref.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(directory, f"{safe_ref}.json.gz")
+
+
+def write_archive(directory: str, ref: str, address: str, raw_pages: dict, delta: bool = False) -> str:
+    """
+    Saves the HTML a business was parsed from (see GoogleBusiness.raw_pages) as gzipped JSON.
+    The file is written under a temporary name and renamed so a crash never leaves half an archive.
+    """
+
+    filename = archive_filename(directory, ref)
+    archive = {
+        'version': ARCHIVE_VERSION,
+        'business_ref': ref,
+        'address': address,
+        'scraped': time(),
+        'delta': delta,
+        'place_panel': raw_pages.get('place_panel'),
+        'popular_times': raw_pages.get('popular_times'),
+        'review_batches': raw_pages.get('review_batches', []),
+        # Set by a --delta run, the first review in the batches that an earlier run had already scraped
+        'known_review_id': raw_pages.get('known_review_id'),
+    }
+    with gzip.open(filename + ".tmp", "wt", encoding="utf-8") as archive_file:
+        json.dump(archive, archive_file)
+    os.replace(filename + ".tmp", filename)
+    return filename
+
+
+def read_archive(filename: str) -> dict:
+    with gzip.open(filename, "rt", encoding="utf-8") as archive_file:
+        return json.load(archive_file)
+
+
+def reparse_archive(filename: str) -> tuple:
+    """
+    Runs the extractors over an archived business, returning the details, popular times and
+    reviews exactly as a live scrape would, plus the time it was scraped. For a --delta run the
+    reviews stop where the live scrape stopped, before the first one an earlier run had scraped.
+    Module level so it can run in a process pool.
+    """
+
+    archive = read_archive(filename)
+    ref = archive['business_ref']
+
+    details = parse_details(archive['place_panel'], ref) if archive['place_panel'] else None
+    if archive['popular_times']:
+        popular_times = parse_popular_times(archive['popular_times'], ref)
+    else:
+        popular_times = no_popular_times(ref)
+
+    reviews = new_review_dict()
+    review_ids = []
+    for batch_html in archive['review_batches']:
+        parse_review_feed(batch_html, ref, reviews, review_ids)
+
+    known_review_id = archive.get('known_review_id')
+    if known_review_id in review_ids:
+        known_at = review_ids.index(known_review_id)
+        reviews = {column: rows[:known_at] for column, rows in reviews.items()}
+    return details, popular_times, reviews, archive['scraped']
@@ -1,27 +1,125 @@
 import logging
 import os
-import re
-from time import sleep
+from time import perf_counter
 
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from selenium.webdriver import ActionChains
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
-from gmaps.exceptions import EmptyBusinessError, FactoryError, BrowserError
+from gmaps.delta import review_fingerprint
+from gmaps.exceptions import EmptyBusinessError, FactoryError, FactoryTimeoutError, BrowserError
+from gmaps.logs import CONSOLE
+from gmaps.metrics import phase, timed_iter
+from gmaps.places import NO_MATCH, PlaceCache
+from gmaps.parse import new_review_dict, no_popular_times, parse_details, parse_popular_times, parse_review_feed
 
-GOOGLE_MAPS_URL = "https://www.google.com/maps?q="
 MAPS_SUMMARY = 1
 MAPS_REVIEWS = 2
+# The panel each data set is read from
+DATA_SET_PANELS = {'details': MAPS_SUMMARY, 'popular_times': MAPS_SUMMARY, 'reviews': MAPS_REVIEWS}
+OVERVIEW_TAB = "//button[@role='tab' and contains(@aria-label, 'Overview')]"
+PLACE_PAGE = "//h2[contains(text(), 'Photos')]"
+# What Google maps shows when a search has no single place: its can't find message, or a list of results
+SEARCH_NO_MATCH = ("//*[starts-with(normalize-space(text()), 'Google Maps can')] | "
+                   "//div[@role='feed' and starts-with(@aria-label, 'Results for')]")
+# Outcomes of _open_place
+PLACE_OPENED = 'place'
+PLACE_NOT_FOUND = 'no_match'
+PLACE_TIMEOUT = 'timeout'
 REVIEW_SCROLL_DIV = '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]'
 REVIEW_ITEM_CLASS = 'jftiEf.fontBodyMedium'
+PRUNED_REVIEW_CLASS = 'gmaps-pruned'
+# Loading indicator at the bottom of the review feed, removed once the last page of reviews has loaded
+REVIEW_FEED_LOADER = '.lXJj5c'
+REVIEW_MORE_BUTTON = '.w8nwRe.kyuRq:not([aria-expanded="true"])'
+
+# Reviews in arguments[0] not yet harvested, from index arguments[1] or from 0 when arguments[2] says harvested
+# reviews are pruned (see HARVEST_REVIEWS_SCRIPT)
+UNHARVESTED_REVIEWS = f"""
+const unharvested = Array.from(arguments[0].querySelectorAll('.{REVIEW_ITEM_CLASS}'))
+    .slice(arguments[2] ? 0 : arguments[1]);
+"""
+# Clicks the More buttons of the unharvested reviews that have not been tried before, marking each one
+# with data-gmaps-tried so a button that never expands is not clicked and waited on again. Returns [clicked, failed]
+EXPAND_REVIEWS_SCRIPT = UNHARVESTED_REVIEWS + f"""
+let clicked = 0;
+let failed = 0;
+unharvested.forEach(item => item.querySelectorAll('{REVIEW_MORE_BUTTON}:not([data-gmaps-tried])').forEach(button => {{
+    button.dataset.gmapsTried = 'true';
+    clicked += 1;
+    try {{ button.click(); }} catch (e) {{ failed += 1; }}
+}}));
+return [clicked, failed];
+"""
+# Returns the number of More buttons clicked by EXPAND_REVIEWS_SCRIPT in the unharvested reviews still collapsed
+COLLAPSED_REVIEWS_SCRIPT = UNHARVESTED_REVIEWS + f"""
+return unharvested.reduce(
+    (count, item) => count + item.querySelectorAll('{REVIEW_MORE_BUTTON}[data-gmaps-tried]').length, 0);
+"""
+# Returns the outerHTML of the reviews in arguments[0] from index arguments[1] then scrolls to the bottom.
+# When arguments[2] is true the harvested reviews are swapped for empty placeholders to keep the DOM small,
+# which leaves only unharvested reviews in the feed so the next harvest starts from index 0.
+HARVEST_REVIEWS_SCRIPT = f"""
+const items = arguments[0].querySelectorAll('.{REVIEW_ITEM_CLASS}');
+const batch = [];
+for (let i = arguments[2] ? 0 : arguments[1]; i < items.length; i++) {{
+    batch.push(items[i].outerHTML);
+    if (arguments[2]) {{
+        const placeholder = document.createElement('div');
+        placeholder.className = '{PRUNED_REVIEW_CLASS}';
+        placeholder.dataset.reviewId = items[i].dataset.reviewId || '';
+        items[i].replaceWith(placeholder);
+    }}
+}}
+arguments[0].scrollTop = arguments[0].scrollHeight;
+return batch;
+"""
+
+# Returns the outerHTML of the place panel holding the business summary
+PLACE_PANEL_SCRIPT = "return (document.querySelector(\"div[role='main']\") || document.body).outerHTML;"
+# Returns the outerHTML of the popular times histogram, which holds the graphs for all seven days
+POPULAR_TIMES_SCRIPT = "const graph = document.querySelector('.C7xf8b'); return graph ? graph.outerHTML : null;"
+# Waits for unharvested reviews to appear in arguments[0] using a MutationObserver and
+# returns [result, loader_seen] where result is 'reviews', 'end' (the feed's loading indicator
+# has gone) or 'idle' (nothing changed for arguments[3] ms). The end of list signal is only
+# trusted once the loading indicator has been seen, arguments[4], so a renamed class falls
+# back to the idle timeout rather than ending early.
+WAIT_FOR_REVIEWS_SCRIPT = f"""
+const [feed, cursor, prune, idleMs, loaderSeen] = arguments;
+const done = arguments[arguments.length - 1];
+const pending = () => feed.querySelectorAll('.{REVIEW_ITEM_CLASS}').length > (prune ? 0 : cursor);
+const loading = () => feed.querySelector('{REVIEW_FEED_LOADER}') !== null;
+let seen = loaderSeen || loading();
+let finished = false;
+let timer = null;
+const observer = new MutationObserver(check);
+
+function finish(result) {{
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done([result, seen]);
+}}
+
+function check() {{
+    seen = seen || loading();
+    if (pending()) finish('reviews');
+    else if (seen && !loading()) finish('end');
+}}
+
+check();
+if (!finished) {{
+    observer.observe(feed, {{childList: true, subtree: true}});
+    timer = setTimeout(() => finish('idle'), idleMs);
+}}
+"""
 
 load_dotenv()  # take environment variables from .env.
 
@@ -35,6 +133,14 @@ else:
 logger = logging.getLogger("gmaps.business")
 logger.setLevel(log_level)
 
+# Search URL the business name and address is appended to, overridden to point at a local stand-in for benchmarks
+GOOGLE_MAPS_URL = str(os.environ.get('G_MAPS_URL', "https://www.google.com/maps?q="))
+# Maximum number of reviews scraped per business, 0 for no limit
+REVIEW_LIMIT = int(os.environ.get('G_MAPS_REVIEW_LIMIT', 1000))
+PRUNE_REVIEWS = str(os.environ.get('G_MAPS_PRUNE_REVIEWS', "true")).upper() == "TRUE"
+# Seconds without new reviews before the review feed is treated as finished
+SCROLL_IDLE_TIMEOUT = float(os.environ.get('G_MAPS_SCROLL_IDLE_TIMEOUT', 10))
+
 
 class GoogleBusiness:
 
@@ -44,10 +150,43 @@ class GoogleBusiness:
         self.address = None
         self._chrome_driver = None
         self._focus = MAPS_SUMMARY
+        self.peak_js_heap = 0
+        self.peak_dom_nodes = 0
+        self.review_total = 0
+        self.new_review_fingerprints = []
+        self.reviews_edited = False
+        self.page_loads = 0
+        # When set to a dict, the HTML each data set is parsed from is kept in it for gmaps.archive
+        self.raw_pages = None
+
+    def plan(self, data_sets: list) -> list:
+        """
+        Orders the requested data sets so each panel is visited once, starting with
+        the panel already showing, which avoids switching back and forth.
+        """
+        return sorted(data_sets, key=lambda data_set: DATA_SET_PANELS[data_set] != self._focus)
+
+    def collect(self, data_sets: list = None, known_reviews: dict = None) -> dict:
+        """
+        Collects the requested data sets ('details', 'popular_times', 'reviews') in the
+        cheapest navigation order and returns them by name.
+        """
+
+        if data_sets is None:
+            data_sets = list(DATA_SET_PANELS)
+
+        collected = {}
+        for data_set in self.plan(data_sets):
+            with phase(data_set):
+                if data_set == 'details':
+                    collected[data_set] = self.get_details()
+                elif data_set == 'popular_times':
+                    collected[data_set] = self.get_popular_times()
+                else:
+                    collected[data_set] = self.get_reviews(known_reviews)
 
-    def __del__(self):
-        if self._chrome_driver:
-            self._chrome_driver.close()
+        log_info(f"[{self.ref}] Collected {', '.join(collected)} with {self.page_loads} page loads")
+        return collected
 
     def get_details(self) -> dict:
         if self.no_match:
@@ -56,140 +195,257 @@ class GoogleBusiness:
         self._switch_to_summary()
         log_info(f"[{self.ref}] Getting business information")
 
-        business_details = {
-            'business_ref': self.ref,
-            'business_name': self._get_business_name(),
-            'address': self._get_address(),
-            'avg_rating': self._get_rating(),
-            'total_reviews': self._get_review_total(),
-            'service_options': self._get_service_options(),
-        }
+        # Read the whole place panel in one call and pick the summary fields out of it locally
+        start_time = perf_counter()
+        start_round_trips = getattr(self._chrome_driver, "round_trips", 0)
+        panel_html = self._chrome_driver.execute_script(PLACE_PANEL_SCRIPT)
+        if self.raw_pages is not None:
+            self.raw_pages['place_panel'] = panel_html
+        business_details = parse_details(panel_html, self.ref)
+        log_info(f"[{self.ref}] Business information read in "
+                 f"{getattr(self._chrome_driver, 'round_trips', 0) - start_round_trips} WebDriver round-trips, "
+                 f"{round((perf_counter() - start_time) * 1000)} ms")
         return business_details
 
     def get_popular_times(self):
         if self.no_match:
             raise EmptyBusinessError("Unable to return popular times when no match returned from Google maps.")
 
+        self._switch_to_summary()
         log_info(f"[{self.ref}] Getting popular times")
-        days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        popular_times = []
 
         try:
-            # Scroll down to make the popular times graph visible
-            ActionChains(self._chrome_driver).move_to_element(
-                self._chrome_driver.find_element(By.CLASS_NAME, "C7xf8b")).perform()
-            popular_times_heading = self._chrome_driver.find_element(By.XPATH,
-                                                                     "//h2[contains(text(), 'Popular times')]")
-            parent = popular_times_heading.parent
-            drop_down = parent.find_element(By.CLASS_NAME, "goog-menu-button-dropdown")
-
-            for day in days:
-                popular_hours = self._get_day_times(day, str(days.index(day)), drop_down)
-                for hour in popular_hours:
-                    popular_times.append(hour)
-            return popular_times
+            # Every day of the histogram is already in the page, read them all in one call
+            graph_html = self._chrome_driver.execute_script(POPULAR_TIMES_SCRIPT)
+            if self.raw_pages is not None:
+                self.raw_pages['popular_times'] = graph_html
+            if graph_html is None:
+                raise NoSuchElementException("Popular times graph not found")
+            return parse_popular_times(graph_html, self.ref)
         except Exception as e:
             log_exception(f"[{self.ref}] Unable to get popular times")
-            return {'business_ref': self.ref, 'percent_busy': "none", 'hour_no': "none", 'each_hour': "none",
-                    'day_of_week': "none"}
+            return no_popular_times(self.ref)
+
+    def get_reviews(self, known_reviews: dict = None):
+        """
+        Returns the reviews newest first. In delta mode, known_reviews holds the review total and
+        the newest reviews seen by an earlier run (see ReviewFingerprints.known), scrolling stops at
+        the first of those and only the new reviews are returned. The new reviews' (id, fingerprint)
+        pairs are left in new_review_fingerprints and reviews_edited flags a list that looks edited.
+        """
 
-    def get_reviews(self):
         if self.no_match:
             raise EmptyBusinessError("Unable to return popular times when no match returned from Google maps.")
 
         log_info(f"[{self.ref}] Getting reviews")
-        process_count = 0
 
         self._switch_to_review()
         review_count = self._get_review_count()
+        self.review_total = review_count
         self._adjust_sort_order()
-        all_items = self._scroll_div_bottom(review_count)
-
-        rev_dict = {
-            'business_ref': [],
-            'reviewer_name': [],
-            'rating': [],
-            'reviewed_dt': [],
-            'review': []}
 
-        sleep(1)
         log_info(f"[{self.ref}] Processing reviews")
-        for item in all_items:
-            # Check if review has been shortened then click the More button
-            more_buttons = item.find_elements(By.CLASS_NAME, 'w8nwRe.kyuRq')
-            for button in more_buttons:
-                try:
-                    button.click()
-                    sleep(1)
-                except Exception as e:
-                    log_exception(f"Unable to expand shortened review for {item.accessible_name}")
+        rev_dict = new_review_dict()
+        review_ids = []
+        reached_known = False
+        harvest = self._scroll_div_bottom(review_count)
+        # Each batch holds only the newly loaded reviews so parsing keeps pace with scrolling
+        for batch_html in timed_iter(harvest, 'reviews_scroll'):
+            if self.raw_pages is not None:
+                self.raw_pages.setdefault('review_batches', []).append(batch_html)
+            if known_reviews is None:
+                with phase('reviews_parse'):
+                    parse_review_feed(batch_html, self.ref, rev_dict)
+                continue
+
+            batch_ids = []
+            with phase('reviews_parse'):
+                batch = parse_review_feed(batch_html, self.ref, review_ids=batch_ids)
+            known_at = next((index for index, review_id in enumerate(batch_ids)
+                             if review_id in known_reviews['reviews']), len(batch_ids))
+            for column in rev_dict:
+                rev_dict[column].extend(batch[column][:known_at])
+            review_ids.extend(batch_ids[:known_at])
+
+            if known_at < len(batch_ids):
+                # Newest first, so every review from here on was scraped by an earlier run
+                reached_known = True
+                if self.raw_pages is not None:
+                    # The archived batch runs past it, reparse_archive stops here too
+                    self.raw_pages['known_review_id'] = batch_ids[known_at]
+                self._check_known_reviews(batch, batch_ids, known_at, known_reviews['reviews'])
+                harvest.close()
+                break
+
+        if known_reviews is not None:
+            self._check_review_delta(rev_dict, review_ids, reached_known, known_reviews)
+
+        log_debug(f"{len(rev_dict['review'])} reviews processed")
+        return rev_dict
+
+    def _check_known_reviews(self, batch: dict, batch_ids: list, known_at: int, known: dict):
+        """ Flags the review list as edited when a known review in the batch no longer matches its fingerprint """
+        for index in range(known_at, len(batch_ids)):
+            known_fingerprint = known.get(batch_ids[index])
+            if known_fingerprint is not None and \
+                    known_fingerprint != review_fingerprint(batch['rating'][index], batch['review'][index]):
+                log_info(f"[{self.ref}] Review {batch_ids[index]} has changed since the last run")
+                self.reviews_edited = True
+
+    def _check_review_delta(self, rev_dict: dict, review_ids: list, reached_known: bool, known_reviews: dict):
+        new_count = len(rev_dict['review'])
+        self.new_review_fingerprints = [
+            (review_id, review_fingerprint(rating, review))
+            for review_id, rating, review in zip(review_ids, rev_dict['rating'], rev_dict['review'])]
+
+        # The newest reviews from the last run should be found unless the limit stopped the scroll first
+        limit_reached = REVIEW_LIMIT and new_count >= REVIEW_LIMIT
+        if known_reviews['reviews'] and not reached_known and not limit_reached:
+            log_info(f"[{self.ref}] None of the reviews seen by the last run were found")
+            self.reviews_edited = True
+
+        # Reviews removed since the last run show up as a total that does not add up
+        previous_total = known_reviews['review_total']
+        if previous_total is not None and self.review_total - previous_total != new_count and not limit_reached:
+            log_info(f"[{self.ref}] Review total changed by {self.review_total - previous_total} "
+                     f"but {new_count} new reviews were found")
+            self.reviews_edited = True
+
+        log_info(f"[{self.ref}] {new_count} new reviews since the last run")
+
+    def _expand_reviews(self, container: WebElement, cursor: int):
+        """
+        Clicks the More buttons on the shortened reviews loaded since the harvest cursor in one
+        in-page operation, then waits once until none of them are left collapsed. Buttons are
+        only tried once, so one that never expands costs a single wait rather than one per scroll.
+        """
 
-            html_item = item.get_attribute("outerHTML")
-            bs_item = BeautifulSoup(html_item, 'html.parser')
-            rev_dict['business_ref'].append(self.ref)
+        try:
+            clicked, failed = self._chrome_driver.execute_script(EXPAND_REVIEWS_SCRIPT, container, cursor,
+                                                                 PRUNE_REVIEWS)
+        except Exception as e:
+            log_exception(f"[{self.ref}] Unable to expand shortened reviews")
+            return 0, 0
 
+        if clicked:
             try:
-                name_test = bs_item.find('div', class_='d4r55').text.strip()
-                log_debug(f"Reviewer {name_test}")
-                rev_dict['reviewer_name'].append(bs_item.find('div', class_='d4r55').text.strip())
-                rev_dict['rating'].append(bs_item.find('span', class_='kvMYJc')["aria-label"])
-                rev_dict['reviewed_dt'].append(bs_item.find('span', class_='rsqaWe').text)
-                review = bs_item.find('span', class_='wiI7pd')
-                if review is None:
-                    review = ""
-                else:
-                    review = review.text
-                rev_dict['review'].append(review)
-                process_count += 1
+                WebDriverWait(self._chrome_driver, timeout=5).until(
+                    lambda driver: driver.execute_script(COLLAPSED_REVIEWS_SCRIPT, container, cursor,
+                                                         PRUNE_REVIEWS) == 0)
+            except TimeoutException:
+                failed = self._chrome_driver.execute_script(COLLAPSED_REVIEWS_SCRIPT, container, cursor,
+                                                            PRUNE_REVIEWS)
+                log_error(f"[{self.ref}] Timeout while waiting for {failed} shortened reviews to expand")
 
-            except Exception as e:
-                log_exception("Error getting review data")
-
-        log_debug(f"{process_count} reviews processed")
-        return rev_dict
+        return clicked - failed, failed
 
     def _scroll_div_bottom(self, review_count: int):
+        """
+        Scrolls the review feed and yields the HTML of each batch of newly loaded reviews.
+        A cursor over the reviews already harvested means each scroll only transfers the new ones.
+        """
+
+        total_expanded = 0
+        total_failed = 0
+        cursor = 0
+        wait_time = 0.0
+        harvest_time = 0.0
+        harvest_count = 0
+        feed_status = 'reviews'
+        stall_time = None
         try:
             log_debug(f"[{self.ref}] Scrolling reviews div")
             scrollable_div = self._chrome_driver.find_element(By.XPATH, REVIEW_SCROLL_DIV)
 
-            if review_count >= 1000:
-                scroll_end = 1000
+            if REVIEW_LIMIT and review_count > REVIEW_LIMIT:
+                scroll_end = REVIEW_LIMIT
                 log_info(
-                    f"[{self.ref}] Total reviews exceeds 1000, script is limiting the scrape to 1000 reviews")
+                    f"[{self.ref}] Total reviews exceeds {REVIEW_LIMIT}, script is limiting the scrape to {REVIEW_LIMIT} reviews")
             else:
                 scroll_end = review_count
 
-            scroll_end = scroll_end
-            all_items = self._chrome_driver.find_elements(By.CLASS_NAME, REVIEW_ITEM_CLASS)
-            loop_count = 0
-            current_count = 0
-            while len(all_items) < scroll_end:
-                self._chrome_driver.execute_script('arguments[0].scrollTop = arguments[0].scrollHeight', scrollable_div)
-                try:
-                    WebDriverWait(self._chrome_driver, 10).until(
-                        EC.visibility_of_all_elements_located((By.XPATH, REVIEW_SCROLL_DIV)))
-                except TimeoutException:
-                    log_exception("Timeout while scrolling review div")
-
-                all_items = self._chrome_driver.find_elements(By.CLASS_NAME, REVIEW_ITEM_CLASS)
+            self._chrome_driver.execute_cdp_cmd("Performance.enable", {})
+            self._chrome_driver.set_script_timeout(SCROLL_IDLE_TIMEOUT + 5)
+            loader_seen = False
+            last_review_at = perf_counter()
+            while cursor < scroll_end:
+                expanded, failed = self._expand_reviews(scrollable_div, cursor)
+                total_expanded += expanded
+                total_failed += failed
+
+                # Returns the reviews after the cursor then scrolls to load the next batch
+                harvest_start = perf_counter()
+                new_items = self._chrome_driver.execute_script(HARVEST_REVIEWS_SCRIPT, scrollable_div, cursor,
+                                                               PRUNE_REVIEWS)
+                harvest_time += perf_counter() - harvest_start
+                harvest_count += 1
+                new_items = new_items[:scroll_end - cursor]
+
+                if new_items:
+                    cursor += len(new_items)
+                    self._sample_renderer_memory()
+                    log_debug(f"[{self.ref}] Harvested {len(new_items)} reviews, {cursor} of {scroll_end}")
+                    yield "".join(new_items)
+                    # Resumed after the batch was parsed, so only the time spent on the feed counts
+                    last_review_at = perf_counter()
+
+                if cursor >= scroll_end:
+                    break
+
+                wait_start = perf_counter()
+                feed_status, loader_seen = self._chrome_driver.execute_async_script(
+                    WAIT_FOR_REVIEWS_SCRIPT, scrollable_div, cursor, PRUNE_REVIEWS, SCROLL_IDLE_TIMEOUT * 1000,
+                    loader_seen)
+                wait_time += perf_counter() - wait_start
 
                 # there are instances of review total on the page being more than the
-                # returned reviews (due to browser limitations) which causes this scroll to be infinite. This should stop it.
-                if len(all_items) == current_count:
-                    loop_count += 1
-                    if loop_count == 100:
-                        log_error(
-                            f"[{self.ref}] Error, unable to load additional reviews. Expected {scroll_end} but returned {len(all_items)}")
-                        break
-                else:
-                    loop_count = 0
-                current_count = len(all_items)
+                # returned reviews (due to browser limitations), stop once the feed says it has no more.
+                if feed_status != 'reviews':
+                    stall_time = perf_counter() - last_review_at
+                if feed_status == 'end':
+                    log_info(f"[{self.ref}] Reached the end of the review list at {cursor} of {scroll_end} reviews")
+                    break
+                if feed_status == 'idle':
+                    log_error(
+                        f"[{self.ref}] Error, unable to load additional reviews. Expected {scroll_end} but returned {cursor}")
+                    break
             log_debug(f"[{self.ref}] Finished scrolling")
-            return all_items
         except Exception as e:
             log_exception("Error whilst fetching reviews")
-            return None
+        finally:
+            log_info(f"[{self.ref}] Expanded {total_expanded} shortened reviews, {total_failed} failed")
+            log_info(f"[{self.ref}] Peak renderer memory {round(self.peak_js_heap / 1048576, 1)} MB JS heap, "
+                     f"{self.peak_dom_nodes} DOM nodes")
+            self._log_feed_waits(wait_time, stall_time, harvest_time, harvest_count)
+
+    def _log_feed_waits(self, wait_time: float, stall_time: float, harvest_time: float, harvest_count: int):
+        """
+        Logs the time spent waiting on the review feed and an estimate of the wall-clock time saved
+        against the old fixed delays: the sleep(1) before processing, and, when the feed stopped short
+        of the expected total, the old stall counter's 100 polls (each at least one round-trip, like a
+        harvest) in place of the time from the last new reviews to giving up.
+        """
+
+        saving = 1.0
+        if stall_time is not None and harvest_count:
+            legacy_stall = 100 * harvest_time / harvest_count
+            saving += legacy_stall - stall_time
+            log_info(f"[{self.ref}] The feed stopped loading reviews {round(stall_time, 2)}s before scrolling ended, "
+                     f"the old stall counter would have polled for at least {round(legacy_stall, 2)}s")
+        log_info(f"[{self.ref}] Review feed waits took {round(wait_time, 2)}s, an estimated {round(saving, 2)}s "
+                 f"saved against the old fixed delays")
+
+    def _sample_renderer_memory(self):
+        """ Records the peak JS heap and DOM node count of the page's renderer """
+        try:
+            metrics = self._chrome_driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]
+        except Exception as e:
+            log_exception(f"[{self.ref}] Unable to read renderer memory")
+            return
+
+        metrics = {metric["name"]: metric["value"] for metric in metrics}
+        self.peak_js_heap = max(self.peak_js_heap, int(metrics.get("JSHeapUsedSize", 0)))
+        self.peak_dom_nodes = max(self.peak_dom_nodes, int(metrics.get("Nodes", 0)))
 
     def _adjust_sort_order(self):
         try:
@@ -197,33 +453,44 @@ class GoogleBusiness:
             self._chrome_driver.find_element(By.XPATH, "//button[@aria-label='Sort reviews']").click()
             WebDriverWait(self._chrome_driver, 10).until(
                 EC.visibility_of_all_elements_located((By.XPATH, "//div[@role='menuitemradio']")))
+            first_review = self._chrome_driver.find_elements(By.CLASS_NAME, REVIEW_ITEM_CLASS)[:1]
             self._chrome_driver.find_element(By.XPATH, "(//div[@role='menuitemradio' and @data-index='1'])").click()
-            WebDriverWait(self._chrome_driver, 10).until(
-                EC.visibility_of_all_elements_located((By.XPATH, REVIEW_SCROLL_DIV)))
+            # The feed is rebuilt in the new order, wait until the old reviews have been replaced
+            if first_review:
+                WebDriverWait(self._chrome_driver, 10).until(EC.staleness_of(first_review[0]))
             log_debug(f"[{self.ref}] Adjusted sort order")
         except Exception as e:
             log_exception("Error whilst changing sort oder of reviews")
 
     def _switch_to_review(self):
         if self._focus != MAPS_REVIEWS:
-            self._chrome_driver.refresh()
+            # Switch tabs in place, only reload the page if the reviews tab does not open
+            if not self._click_reviews_tab():
+                log_error(f"[{self.ref}] Unable to open reviews in place, reloading the page")
+                self._chrome_driver.refresh()
+                self.page_loads += 1
+                if not self._click_reviews_tab():
+                    log_error("Timeout while loading review page")
+                    # self._webdriver.save_screenshot(f"{self._business_ref}_review_screenshot.png")
+                    return
+            self._focus = MAPS_REVIEWS
+
+    def _click_reviews_tab(self) -> bool:
+        try:
             ActionChains(self._chrome_driver).move_to_element(
                 self._chrome_driver.find_element(By.CLASS_NAME, "RWPxGd")).perform()
-            try:
-                reviews_button = self._chrome_driver.find_element(By.XPATH, "//button[contains(@aria-label, 'Reviews')]")
-                if reviews_button is not None:
-                    reviews_button.click()
-            except Exception as e:
-                log_exception("Unable to click reviews button")
-
-            try:
-                WebDriverWait(self._chrome_driver, 10).until(
-                    EC.visibility_of_all_elements_located((By.XPATH, "//div[@role='radiogroup']")))
-                self._focus = MAPS_REVIEWS
+            self._chrome_driver.find_element(By.XPATH, "//button[contains(@aria-label, 'Reviews')]").click()
+        except Exception as e:
+            log_exception("Unable to click reviews button")
+            return False
 
-            except TimeoutException:
-                log_exception("Timeout while loading review page")
-                # self._webdriver.save_screenshot(f"{self._business_ref}_review_screenshot.png")
+        try:
+            WebDriverWait(self._chrome_driver, 10).until(
+                EC.visibility_of_all_elements_located((By.XPATH, "//div[@role='radiogroup']")))
+            return True
+        except TimeoutException:
+            log_exception("Timeout while loading review page")
+            return False
 
     def _get_review_count(self):
         try:
@@ -237,118 +504,96 @@ class GoogleBusiness:
             log_exception("Error whilst reading review count")
             return 0
 
-    def _get_day_times(self, day: str, day_index: str, drop_down: WebElement):
-        popular_times = []
-        log_debug(f"[{self.ref}] Getting {day} hours.")
-        drop_down.click()
-        WebDriverWait(self._chrome_driver, timeout=3).until(
-            EC.visibility_of_all_elements_located((By.CLASS_NAME, "goog-menuitem")))
-        option = self._chrome_driver.find_element(By.ID, ':' + day_index)
-        option.click()
-        graph_parent = self._chrome_driver.find_element(By.CLASS_NAME, "C7xf8b")
-        all_hours = graph_parent.find_elements(By.CLASS_NAME, "dpoVLd")
-        for each_hour in all_hours:
-            label_text = each_hour.get_attribute("aria-label").split()
-            if label_text[0] != 'Currently':
-                popular_time_day = {
-                    'business_ref': self.ref,
-                    'percent_busy': label_text[0].replace("%", ''),
-                    'hour_no': int(label_text[3]) if (
-                            label_text[4].upper() == "AM." or int(label_text[3]) == 12) else int(
-                        label_text[3]) + 12,
-                    'each_hour': each_hour.get_attribute('aria-label'),
-                    'day_of_week': day
-                }
-                popular_times.append(popular_time_day)
-        return popular_times
-
-    def _get_business_name(self) -> str:
-        parent_div = self._chrome_driver.find_element(By.CLASS_NAME, "tAiQdd")
-        return parent_div.find_element(By.XPATH, "//h1").text
-
-    def _get_address(self) -> str:
-        try:
-            label = self._chrome_driver.find_element(By.XPATH,
-                                                     "//button[contains(@aria-label, 'Address')]").get_attribute(
-                "aria-label")
-            return label.split(":")[1].strip()
-        except NoSuchElementException as e:
-            log_exception(f"[{self._chrome_driver}] - Unable to get address for {self.ref}")
-            return "No Address"
-
-    def _get_rating(self) -> str:
-        try:
-            parent_div = self._chrome_driver.find_element(By.CLASS_NAME, "F7nice")
-            rating = parent_div.find_element(By.XPATH, "//span[contains(@role, 'img')]").get_attribute(
-                "aria-label").strip()
-            return rating
-        except NoSuchElementException as e:
-            log_exception(f"[{self.ref}] Unable to get rating for {self.ref}")
-            return "No rating"
-
-    def _get_review_total(self) -> str:
-        try:
-            review_count = self._chrome_driver.find_element(By.XPATH, "//span[contains(@aria-label, 'reviews')]").text
-            return re.sub('[()]', '', review_count)
-        except NoSuchElementException as e:
-            log_exception(f"[{self._chrome_driver}] Unable to get review count")
-            return "0"
-
-    def _get_service_options(self) -> str:
-        return_str = []
-        all_options = self._chrome_driver.find_elements(By.CLASS_NAME, "LTs0Rc")
-        for option in all_options:
-            return_str.append(option.get_attribute("aria-label"))
-        return ", ".join(return_str)
-
     def _switch_to_summary(self):
         if self._focus != MAPS_SUMMARY:
-            self._chrome_driver.back()
+            # Switch tabs in place, only go back and reload the page if the overview tab does not open
             try:
+                self._chrome_driver.find_element(By.XPATH, OVERVIEW_TAB).click()
                 WebDriverWait(self._chrome_driver, timeout=10).until(
-                    EC.presence_of_element_located((By.XPATH, "//h2[contains(text(), 'Photos')]")))
-            except TimeoutException:
-                log_exception("Timeout while loading summary page")
-                # self._webdriver.save_screenshot(f"{self._business_ref}_summary_screenshot.png")
+                    EC.presence_of_element_located((By.XPATH, PLACE_PAGE)))
+            except (NoSuchElementException, TimeoutException):
+                log_exception(f"[{self.ref}] Unable to open the summary in place, reloading the page")
+                self._chrome_driver.back()
+                self.page_loads += 1
+                try:
+                    WebDriverWait(self._chrome_driver, timeout=10).until(
+                        EC.presence_of_element_located((By.XPATH, PLACE_PAGE)))
+                except TimeoutException:
+                    log_exception("Timeout while loading summary page")
+                    # self._webdriver.save_screenshot(f"{self._business_ref}_summary_screenshot.png")
 
-            # Needed as menu item number changes to letters moving from reviews back to summary
-            self._chrome_driver.refresh()
+                self._chrome_driver.refresh()
+                self.page_loads += 1
             self._focus = MAPS_SUMMARY
 
 
-def business_factory(ref: str, address: str, driver_path: str) -> GoogleBusiness:
+def business_factory(ref: str, address: str, chrome_driver: webdriver.Chrome,
+                     place_cache: PlaceCache = None) -> GoogleBusiness:
     """
-    Creates an instance of GoogleBusiness.
-    Factory does not manage instances after creation.
+    Creates an instance of GoogleBusiness using the supplied browser session.
+    The session is owned by the caller (see gmaps.session.SessionPool), the
+    factory does not close it and does not manage instances after creation.
+
+    With a place_cache, a place found by an earlier run is opened directly and a search
+    known to have no match fails straight away. A cached place that no longer opens falls
+    back to searching.
     """
 
-    chrome_driver = webdriver.Chrome(service=ChromeService(driver_path), options=get_options())
-    chrome_driver.get(GOOGLE_MAPS_URL + address.replace(" ", "+"))
-    WebDriverWait(chrome_driver, timeout=10).until(EC.visibility_of_all_elements_located((By.ID, "searchboxinput")))
-    consent_check(chrome_driver)
+    cached_url = place_cache.lookup(address) if place_cache is not None else None
+    if cached_url == NO_MATCH:
+        raise FactoryError(f"Google maps returned no match for {ref} in an earlier run, skipping until it expires")
 
     new_business = GoogleBusiness()
-
-    try:
-        WebDriverWait(chrome_driver, timeout=5).until(
-            EC.presence_of_element_located((By.XPATH, "//h2[contains(text(), 'Photos')]")))
-
+    new_business.ref = ref
+    new_business.address = address
+    new_business._chrome_driver = chrome_driver
+
+    if cached_url:
+        log_debug(f"[{ref}] Opening cached place {cached_url}")
+        if _open_place(chrome_driver, cached_url) == PLACE_OPENED:
+            new_business.no_match = False
+            new_business.page_loads = 1
+            return new_business
+        log_info(f"[{ref}] Cached place no longer opens, searching instead")
+        place_cache.forget(address)
+        new_business.page_loads = 1
+
+    search_url = GOOGLE_MAPS_URL + address.replace(" ", "+")
+    outcome = _open_place(chrome_driver, search_url)
+    if outcome == PLACE_OPENED:
         new_business.no_match = False
-        new_business.ref = ref
-        new_business.address = address
-        new_business._chrome_driver = chrome_driver
+        new_business.page_loads += 1
+        # Google maps moves a matched search to the place's own URL, only that is worth remembering
+        if place_cache is not None and chrome_driver.current_url != search_url:
+            place_cache.store(address, chrome_driver.current_url)
         return new_business
 
-    except TimeoutException:
-        if chrome_driver is not None:
-            chrome_driver.close()
-        raise FactoryError(
-            f"Timeout waiting for browser returning info for {ref}, possible no match found in Google maps.") from None
+    if outcome == PLACE_NOT_FOUND:
+        # Only a page that says there is no match is remembered, a slow page says nothing about the search
+        if place_cache is not None:
+            place_cache.store(address, NO_MATCH)
+        raise FactoryError(f"Google maps returned no match for {ref}")
+    raise FactoryTimeoutError(f"Timeout waiting for browser returning info for {ref}")
 
-    except NoSuchElementException:
-        if chrome_driver is not None:
-            chrome_driver.close()
-        raise FactoryError(f"Google maps returned no match for {ref}") from None
+
+def _open_place(chrome_driver: webdriver.Chrome, url: str) -> str:
+    """
+    Opens a search or place URL and waits for the page to settle, returning PLACE_OPENED for a
+    place page, PLACE_NOT_FOUND when Google maps shows it has no match and PLACE_TIMEOUT when
+    neither appears in time.
+    """
+
+    chrome_driver.get(url)
+    WebDriverWait(chrome_driver, timeout=10).until(EC.visibility_of_all_elements_located((By.ID, "searchboxinput")))
+    consent_check(chrome_driver)
+
+    try:
+        WebDriverWait(chrome_driver, timeout=5).until(EC.any_of(
+            EC.presence_of_element_located((By.XPATH, PLACE_PAGE)),
+            EC.presence_of_element_located((By.XPATH, SEARCH_NO_MATCH))))
+    except TimeoutException:
+        return PLACE_TIMEOUT
+    return PLACE_OPENED if chrome_driver.find_elements(By.XPATH, PLACE_PAGE) else PLACE_NOT_FOUND
 
 
 def get_options() -> Options:
@@ -360,6 +605,9 @@ def get_options() -> Options:
     chrome_options.add_argument("--incognito")
     chrome_options.add_argument("--locale=en")
     chrome_options.add_argument("force-device-scale-factor=0.5")
+    # Network events are logged so the requests and bytes used per business can be reported
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    chrome_options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
     return chrome_options
 
 
@@ -378,25 +626,20 @@ def consent_check(chrome_drive: webdriver.Chrome):
 
 
 def log_exception(message: str):
-    """ Logs an exception message to the log file but also prints it to the terminal """
-    print(message)
-    logger.exception(message)
+    """ Logs an exception message to the log file and the terminal, both written by the listener in gmaps.logs """
+    logger.exception(message, extra=CONSOLE, stacklevel=2)
 
 
 def log_info(message: str):
-    """ Logs an information message to the log file but also prints it to the terminal """
-    print(message)
-    logger.info(message)
+    """ Logs an information message to the log file and the terminal """
+    logger.info(message, extra=CONSOLE, stacklevel=2)
 
 
 def log_debug(message: str):
-    """ Logs a debug message to the log file but also prints it to the terminal """
-    if DEBUG:
-        print(message)
-        logger.debug(message)
+    """ Logs a debug message to the log file and the terminal """
+    logger.debug(message, extra=CONSOLE, stacklevel=2)
 
 
 def log_error(message: str):
-    """ Logs a debug message to the log file but also prints it to the terminal """
-    print(message)
-    logger.error(message)
+    """ Logs an error message to the log file and the terminal """
+    logger.error(message, extra=CONSOLE, stacklevel=2)
@@ -0,0 +1,50 @@
+import sqlite3
+from time import time
+
+
+class Checkpoint:
+    """
+    SQLite record of the outcome of every business_ref in a run, kept beside the outputs
+    so an interrupted run can be resumed without scraping completed businesses again.
+
+    A business is recorded as completed only after its rows are written, so a crash
+    in between means it is scraped again rather than lost.
+    """
+
+    COMPLETED = "completed"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+
+    def __init__(self, filename: str, resume: bool = False):
+        self._connection = sqlite3.connect(filename)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS business ("
+                "business_ref TEXT PRIMARY KEY, status TEXT NOT NULL, detail TEXT, updated REAL NOT NULL)")
+            if not resume:
+                self._connection.execute("DELETE FROM business")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def completed_refs(self) -> set:
+        rows = self._connection.execute("SELECT business_ref FROM business WHERE status = ?", (self.COMPLETED,))
+        return {row[0] for row in rows}
+
+    def counts(self) -> dict:
+        rows = self._connection.execute("SELECT status, COUNT(*) FROM business GROUP BY status")
+        return dict(rows.fetchall())
+
+    def record(self, ref: str, status: str, detail: str = ""):
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO business (business_ref, status, detail, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(business_ref) DO UPDATE SET status = excluded.status, detail = excluded.detail, "
+                "updated = excluded.updated",
+                (ref, status, detail, time()))
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import sqlite3
+from time import time
+
+from dotenv import load_dotenv
+
+load_dotenv()  # take environment variables from .env.
+
+DELTA_DB = str(os.environ.get('G_MAPS_DELTA_DB', "review-fingerprints.sqlite"))
+# Number of newest reviews remembered per business
+FINGERPRINT_SIZE = int(os.environ.get('G_MAPS_DELTA_FINGERPRINTS', 50))
+
+
+def review_fingerprint(rating: str, review: str) -> str:
+    """ Returns a short hash of a review's content, used to spot reviews edited since the last run """
+    return hashlib.sha1(f"{rating}\n{review}".encode("utf-8")).hexdigest()[:12]
+
+
+class ReviewFingerprints:
+    """
+    Persistent record of the newest reviews seen for each business, used by delta runs
+    to stop scrolling at the first review already scraped by an earlier run.
+
+    Every business is loaded into memory when the store is opened so worker threads
+    can read it freely, only the results loop calls update.
+    """
+
+    def __init__(self, filename: str = DELTA_DB):
+        self._connection = sqlite3.connect(filename)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprint ("
+                "business_ref TEXT PRIMARY KEY, review_total INTEGER, reviews TEXT NOT NULL, updated REAL NOT NULL)")
+
+        self._known = {}
+        for ref, review_total, reviews in self._connection.execute(
+                "SELECT business_ref, review_total, reviews FROM fingerprint"):
+            self._known[ref] = {'review_total': review_total, 'reviews': dict(json.loads(reviews))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def known(self, ref: str) -> dict:
+        """
+        Returns the review total and the newest reviews (review id to fingerprint, newest first)
+        seen for a business, empty when the business has not been scraped before.
+        """
+        return self._known.get(ref, {'review_total': None, 'reviews': {}})
+
+    def update(self, ref: str, review_total: int, new_reviews: list):
+        """ Adds the (review id, fingerprint) pairs of the new reviews, newest first, ahead of the known ones """
+        reviews = {review_id: fingerprint for review_id, fingerprint in new_reviews if review_id}
+        for review_id, fingerprint in self.known(ref)['reviews'].items():
+            reviews.setdefault(review_id, fingerprint)
+        reviews = list(reviews.items())[:FINGERPRINT_SIZE]
+
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO fingerprint (business_ref, review_total, reviews, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(business_ref) DO UPDATE SET review_total = excluded.review_total, "
+                "reviews = excluded.reviews, updated = excluded.updated",
+                (ref, review_total, json.dumps(reviews), time()))
+        self._known[ref] = {'review_total': review_total, 'reviews': dict(reviews)}
+
+    def close(self):
+        self._connection.close()
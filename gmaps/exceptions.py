@@ -14,6 +14,13 @@ class FactoryError(Exception):
         super().__init__(self.message)
 
 
+class FactoryTimeoutError(FactoryError):
+    """ Raised by the factory when Google maps does not return a business page in time """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
 class BrowserError(Exception):
     """ General exception for browser/page manipulation errors"""
 
@@ -21,3 +28,10 @@ class BrowserError(Exception):
         self.message = message
         super().__init__(self.message)
 
+
+class ParseError(Exception):
+    """ Exception for required data missing from the page HTML """
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
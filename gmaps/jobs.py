@@ -0,0 +1,124 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from time import time
+
+from dotenv import load_dotenv
+
+from gmaps.checkpoint import Checkpoint
+
+load_dotenv()  # take environment variables from .env.
+
+# Seconds a leased business stays with a worker without a renewal before it is handed to another worker
+JOB_LEASE = int(os.environ.get('G_MAPS_JOB_LEASE', 600))
+# Times a business may be leased before it is failed rather than handed out again
+JOB_MAX_ATTEMPTS = int(os.environ.get('G_MAPS_JOB_MAX_ATTEMPTS', 3))
+
+
+class JobQueue:
+    """
+    SQLite queue of the businesses in a run, shared by any number of worker processes on one or
+    more hosts (the file must be on storage that supports SQLite locking).
+
+    Businesses are leased to one worker at a time. A worker renews the leases of the businesses
+    it is scraping, so the businesses of a worker that crashes are handed out again once their
+    lease expires. Workers pass their id as worker, enqueue and merge can leave it out.
+    record has the same signature as Checkpoint.record and uses its statuses.
+    """
+
+    PENDING = "pending"
+    LEASED = "leased"
+
+    def __init__(self, filename: str, worker: str = None, lease_seconds: int = JOB_LEASE,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Transactions are begun explicitly so leasing takes the write lock before reading
+        self._connection = sqlite3.connect(filename, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS job ("
+            "business_ref TEXT PRIMARY KEY, target TEXT NOT NULL, status TEXT NOT NULL, worker TEXT, "
+            "lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, detail TEXT, updated REAL NOT NULL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def enqueue(self, targets: list) -> int:
+        """ Adds input lines to the queue, returns the number added. Businesses already queued are skipped """
+        now = time()
+        with self._transaction():
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO job (business_ref, target, status, updated) VALUES (?, ?, ?, ?)",
+                [(target.split(",")[0], target, self.PENDING, now) for target in targets])
+            return self._connection.total_changes - before
+
+    def lease(self) -> tuple:
+        """ Leases the next pending business, or one whose lease has expired, returning (ref, target) or None """
+        now = time()
+        with self._transaction():
+            while True:
+                job = self._connection.execute(
+                    "SELECT business_ref, target, attempts FROM job "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY rowid LIMIT 1",
+                    (self.PENDING, self.LEASED, now)).fetchone()
+                if job is None:
+                    return None
+
+                ref, target, attempts = job
+                if attempts >= self.max_attempts:
+                    self._connection.execute(
+                        "UPDATE job SET status = ?, worker = NULL, detail = ?, updated = ? WHERE business_ref = ?",
+                        (Checkpoint.FAILED, f"Lease expired {attempts} times", now, ref))
+                    continue
+
+                self._connection.execute(
+                    "UPDATE job SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, updated = ? "
+                    "WHERE business_ref = ?", (self.LEASED, self.worker, now + self.lease_seconds, now, ref))
+                return ref, target
+
+    def renew(self, refs: list):
+        """ Extends the leases the worker still holds on the businesses it is scraping """
+        now = time()
+        with self._transaction():
+            self._connection.executemany(
+                "UPDATE job SET lease_expires = ? WHERE business_ref = ? AND worker = ? AND status = ?",
+                [(now + self.lease_seconds, ref, self.worker, self.LEASED) for ref in refs])
+
+    def record(self, ref: str, status: str, detail: str = None):
+        """
+        Records the outcome of a leased business. The outcome is ignored when the business has
+        since been leased to another worker, whose rows are then the ones kept by merge.
+        """
+        with self._transaction():
+            self._connection.execute(
+                "UPDATE job SET status = ?, detail = ?, lease_expires = NULL, updated = ? "
+                "WHERE business_ref = ? AND worker IS ?", (status, detail, time(), ref, self.worker))
+
+    def completed_by(self) -> dict:
+        """ Returns the worker whose rows should be kept for each completed business """
+        return dict(self._connection.execute(
+            "SELECT business_ref, worker FROM job WHERE status = ?", (Checkpoint.COMPLETED,)))
+
+    def counts(self) -> dict:
+        """ Returns the number of businesses in each status """
+        return dict(self._connection.execute("SELECT status, COUNT(*) FROM job GROUP BY status"))
+
+    def close(self):
+        self._connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        """ Runs the block in a transaction that takes the write lock up front """
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
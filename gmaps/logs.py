@@ -0,0 +1,61 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+from gmaps import metrics
+
+# Pass as extra to also show a record on the console, see gmaps.business.log_info
+CONSOLE = {'console': True}
+
+
+class ContextFilter(logging.Filter):
+    """ Adds the business_ref and phase being scraped on the logging thread to every record """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ref, phase = metrics.context()
+        record.business_ref = ref or "-"
+        record.phase = phase or "-"
+        return True
+
+
+class _MessageFormatter(logging.Formatter):
+    """ Just the message, tracebacks are left to the log file as they were when the helpers printed """
+
+    def format(self, record: logging.LogRecord) -> str:
+        return record.getMessage()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue as they are. The queue never leaves the process, so the message and
+    any traceback can be formatted by the listener rather than on the scraping thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def start_logging(*handlers: logging.Handler, level: int = logging.ERROR) -> logging.handlers.QueueListener:
+    """
+    Sends every record through a queue to handlers run by a single background listener, so logging from
+    the worker threads never waits on a file write, a rotation or the terminal. Records given the CONSOLE
+    extra are also printed. The listener is stopped, and the queue drained, when the process exits.
+    """
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(_MessageFormatter())
+    console_handler.addFilter(lambda record: getattr(record, "console", False))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    # Filters run on the calling thread, where the current business is known
+    queue_handler.addFilter(ContextFilter())
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logging.basicConfig(handlers=[queue_handler], level=level)
+    return listener
@@ -0,0 +1,189 @@
+import json
+import math
+import threading
+from contextlib import contextmanager
+from time import perf_counter, time
+
+_local = threading.local()
+
+
+class BusinessMetrics:
+    """
+    Timings and counters for scraping one business. Phases may nest, for example
+    reviews_scroll and reviews_parse are both counted inside reviews.
+    """
+
+    def __init__(self, ref: str):
+        self.ref = ref
+        self.started = time()
+        self.total_seconds = 0.0
+        self.phases = {}
+        self.phase_calls = {}
+        self.driver = None
+        self.webdriver_total = 0
+        self._start_calls = 0
+        self.browser_started = False
+        self.reviews = 0
+        self.page_loads = 0
+        self.network = None
+        self.failure = None
+        self._open_phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """ Adds the time, and WebDriver round-trips when a driver is attached, spent in the block to a phase """
+        start_calls = self.webdriver_calls
+        start_time = perf_counter()
+        self._open_phases.append(name)
+        try:
+            yield
+        finally:
+            self._open_phases.pop()
+            self.phases[name] = self.phases.get(name, 0.0) + perf_counter() - start_time
+            self.phase_calls[name] = self.phase_calls.get(name, 0) + self.webdriver_calls - start_calls
+
+    @property
+    def current_phase(self) -> str:
+        """ The innermost phase the business is in, None outside of any """
+        return self._open_phases[-1] if self._open_phases else None
+
+    @property
+    def seconds_without_reviews(self) -> float:
+        """ Total time less review scrolling and parsing, which grow with the number of reviews """
+        return self.total_seconds - self.phases.get('reviews_scroll', 0.0) - self.phases.get('reviews_parse', 0.0)
+
+    @property
+    def webdriver_calls(self) -> int:
+        return getattr(self.driver, "round_trips", 0)
+
+    def attach(self, chrome_driver):
+        """ Counts the round-trips made by the business's browser session from now on """
+        self.driver = chrome_driver
+        self._start_calls = self.webdriver_calls
+
+    def detach(self):
+        if self.driver is None:
+            return
+        self.webdriver_total += self.webdriver_calls - self._start_calls
+        self.driver = None
+
+    def record(self) -> dict:
+        return {
+            'business_ref': self.ref,
+            'started': round(self.started, 3),
+            'total_seconds': round(self.total_seconds, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'webdriver_calls': self.webdriver_total,
+            'phase_webdriver_calls': self.phase_calls,
+            'browser_started': self.browser_started,
+            'reviews': self.reviews,
+            'page_loads': self.page_loads,
+            'network': self.network,
+            'failure': self.failure,
+        }
+
+
+def current() -> BusinessMetrics:
+    """ Returns the metrics of the business being scraped on this thread, or a throwaway instance """
+    business_metrics = getattr(_local, "metrics", None)
+    return business_metrics if business_metrics is not None else BusinessMetrics(None)
+
+
+def context() -> tuple:
+    """ Returns the ref and current phase of the business being scraped on this thread, or (None, None) """
+    business_metrics = getattr(_local, "metrics", None)
+    if business_metrics is None:
+        return None, None
+    return business_metrics.ref, business_metrics.current_phase
+
+
+@contextmanager
+def track(ref: str):
+    """ Makes a new BusinessMetrics current for this thread for the duration of the block """
+    business_metrics = BusinessMetrics(ref)
+    _local.metrics = business_metrics
+    start_time = perf_counter()
+    try:
+        yield business_metrics
+    finally:
+        business_metrics.total_seconds = perf_counter() - start_time
+        business_metrics.detach()
+        _local.metrics = None
+
+
+def phase(name: str):
+    """ Times a block against the current business, see BusinessMetrics.phase """
+    return current().phase(name)
+
+
+def timed_iter(iterable, name: str):
+    """ Yields from iterable, counting only the time spent producing each item against the phase """
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class MetricsWriter:
+    """
+    Appends one JSON line per business to the metrics file and keeps the samples
+    needed for the end of run percentile summary. Safe to call from worker threads.
+    """
+
+    def __init__(self, filename: str, append: bool = False):
+        self._file = open(filename, "a" if append else "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._samples = {}
+        self.failures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, business_metrics: BusinessMetrics):
+        record = business_metrics.record()
+        line = json.dumps(record)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+            self._add_sample('total_seconds', record['total_seconds'])
+            self._add_sample('webdriver_calls', record['webdriver_calls'])
+            self._add_sample('reviews', record['reviews'])
+            for name, seconds in record['phases'].items():
+                self._add_sample(f"{name}_seconds", seconds)
+            if record['failure']:
+                reason = record['failure'].split(":")[0]
+                self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def summary(self) -> list:
+        """ Returns a line per metric with the p50, p90, p99 and max over every business """
+        lines = []
+        with self._lock:
+            for name, samples in self._samples.items():
+                samples = sorted(samples)
+                lines.append(f"{name:<24} n={len(samples):<6} p50={percentile(samples, 50):<10} "
+                             f"p90={percentile(samples, 90):<10} p99={percentile(samples, 99):<10} max={samples[-1]}")
+            for reason, count in self.failures.items():
+                lines.append(f"failures {reason}: {count}")
+        return lines
+
+    def close(self):
+        self._file.close()
+
+    def _add_sample(self, name: str, value):
+        self._samples.setdefault(name, []).append(value)
+
+
+def percentile(sorted_samples: list, percent: float):
+    """ Nearest rank percentile of an already sorted list """
+    if not sorted_samples:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_samples)))
+    return sorted_samples[rank - 1]
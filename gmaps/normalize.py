@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+# Length of each unit Google maps uses in relative review dates, months and years are averaged
+RELATIVE_DATE_UNITS = {
+    'minute': pd.Timedelta(minutes=1),
+    'hour': pd.Timedelta(hours=1),
+    'day': pd.Timedelta(days=1),
+    'week': pd.Timedelta(weeks=1),
+    'month': pd.Timedelta(days=30.4375),
+    'year': pd.Timedelta(days=365.25),
+}
+RELATIVE_DATE_PATTERN = r"\b(a|an|\d+)\s+(minute|hour|day|week|month|year)s?\s+ago"
+
+
+def first_number(text: pd.Series) -> pd.Series:
+    """ Returns the first number in each string, "4.3 stars" gives 4.3, NaN when there is none """
+    return pd.to_numeric(text.astype("string").str.extract(r"(\d+(?:\.\d+)?)", expand=False), errors="coerce")
+
+
+def relative_to_timestamp(relative: pd.Series, scraped_at: pd.Series) -> pd.Series:
+    """
+    Converts relative dates such as "3 months ago" or "Edited a week ago" to UTC timestamps by
+    subtracting them from the time each row was scraped. Google only shows the largest unit, so
+    the result is as precise as the text. Text in any other form gives NaT.
+    """
+
+    parts = relative.astype("string").str.lower().str.extract(RELATIVE_DATE_PATTERN)
+    count = pd.to_numeric(parts[0].replace({'a': "1", 'an': "1"}), errors="coerce").astype("float64")
+    unit_seconds = parts[1].map({unit: length.total_seconds() for unit, length in RELATIVE_DATE_UNITS.items()})
+    return scraped_at - pd.to_timedelta(count * unit_seconds.astype("float64"), unit="s")
+
+
+def normalize_details(details: pd.DataFrame) -> pd.DataFrame:
+    """ avg_rating and total_reviews become numbers, "No rating" becomes null """
+    return details.assign(
+        avg_rating=first_number(details['avg_rating']).astype("float32"),
+        total_reviews=pd.to_numeric(details['total_reviews'].astype("string").str.replace(",", ""),
+                                    errors="coerce").astype("Int64"),
+    )
+
+
+def normalize_popular_times(popular_times: pd.DataFrame) -> pd.DataFrame:
+    """ percent_busy and hour_no become numbers, the "none" placeholder row becomes nulls """
+    return popular_times.assign(
+        percent_busy=pd.to_numeric(popular_times['percent_busy'], errors="coerce").astype("float32"),
+        hour_no=pd.to_numeric(popular_times['hour_no'], errors="coerce").astype("Int8"),
+        each_hour=popular_times['each_hour'].replace("none", np.nan),
+        day_of_week=popular_times['day_of_week'].replace("none", np.nan),
+    )
+
+
+def normalize_reviews(reviews: pd.DataFrame) -> pd.DataFrame:
+    """ rating becomes a number and reviewed_at holds the timestamp the relative reviewed_dt refers to """
+    return reviews.assign(
+        rating=first_number(reviews['rating']).astype("float32"),
+        reviewed_at=relative_to_timestamp(reviews['reviewed_dt'], reviews['scraped_at']),
+    )
+
+
+def normalize_review_delta(review_delta: pd.DataFrame) -> pd.DataFrame:
+    """ new_reviews becomes a number and reviews_edited a boolean """
+    return review_delta.assign(
+        new_reviews=pd.to_numeric(review_delta['new_reviews'], errors="coerce").astype("Int64"),
+        reviews_edited=review_delta['reviews_edited'].astype("boolean"),
+    )
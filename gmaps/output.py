@@ -0,0 +1,223 @@
+import glob
+import os
+from time import gmtime, strftime
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from gmaps.normalize import normalize_details, normalize_popular_times, normalize_review_delta, normalize_reviews
+from gmaps.parse import REVIEW_COLUMNS
+
+try:
+    # Optional, only needed for --format parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+load_dotenv()  # take environment variables from .env.
+
+# Rows of each output collected before they are normalized and written as one Parquet file
+PARQUET_BATCH_ROWS = int(os.environ.get('G_MAPS_PARQUET_BATCH_ROWS', 50000))
+OUTPUT_FORMATS = ['csv', 'parquet']
+
+DETAILS_COLUMNS = ['business_ref', 'business_name', 'address', 'avg_rating', 'total_reviews', 'service_options']
+POPULAR_TIMES_COLUMNS = ['business_ref', 'percent_busy', 'hour_no', 'each_hour', 'day_of_week']
+REVIEW_DELTA_COLUMNS = ['business_ref', 'new_reviews', 'reviews_edited']
+
+
+class CsvOutput:
+    """
+    Appends each business's rows to the output CSVs as soon as it has been scraped.
+
+    Only one thread should write (main's results loop), so no locking is needed.
+    Every write is flushed to disk so the files are valid CSV at any point in a run.
+    """
+
+    def __init__(self, prefix: str, append: bool = False, delta: bool = False):
+        self._outputs = {
+            'details': (f"{prefix}_details.csv", DETAILS_COLUMNS),
+            'popular_times': (f"{prefix}_popular_times.csv", POPULAR_TIMES_COLUMNS),
+            'reviews': (f"{prefix}_reviews.csv", REVIEW_COLUMNS),
+        }
+        if delta:
+            self._outputs['review_delta'] = (f"{prefix}_review_delta.csv", REVIEW_DELTA_COLUMNS)
+        self._files = {}
+        for name, (filename, columns) in self._outputs.items():
+            csv_file = open(filename, "a" if append else "w", newline="", encoding="utf-8")
+            if csv_file.tell() == 0:
+                pd.DataFrame(columns=columns).to_csv(csv_file, index=False)
+            self._files[name] = csv_file
+        self.rows_written = {name: 0 for name in self._outputs}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, business_details: pd.DataFrame, popular_times: pd.DataFrame, reviews: pd.DataFrame,
+              review_delta: pd.DataFrame = None, scraped_at: float = None, on_written=None):
+        """
+        Appends one business's results, any of which may be None. on_written is called once the rows
+        are on disk, which for CSV is before write returns. scraped_at is only used by ParquetOutput.
+        """
+        for name, data in (('details', business_details), ('popular_times', popular_times), ('reviews', reviews),
+                           ('review_delta', review_delta)):
+            if data is None or data.empty or name not in self._files:
+                continue
+
+            csv_file = self._files[name]
+            data.reindex(columns=self._outputs[name][1]).to_csv(csv_file, header=False, index=False)
+            csv_file.flush()
+            os.fsync(csv_file.fileno())
+            self.rows_written[name] += len(data)
+        if on_written is not None:
+            on_written()
+
+    def flush(self):
+        """ Every write is already on disk """
+
+    def close(self):
+        for csv_file in self._files.values():
+            csv_file.close()
+        self._files = {}
+
+
+class ParquetOutput:
+    """
+    Writes each output as a Parquet dataset with typed columns, partitioned by run:
+    [prefix]_reviews/run=[run id]/part-00000.parquet. A resumed run carries on in the latest run.
+
+    Rows are collected until PARQUET_BATCH_ROWS of any output are waiting, then every output is
+    normalized (see gmaps.normalize) in one vectorized pass and written as its next part file.
+    Only then are the on_written callbacks of the businesses in the batch called, so a business
+    is never checkpointed as completed while its rows are still in memory. Relative review dates
+    are anchored at scraped_at, the time each business was scraped.
+    Like CsvOutput, only one thread should write.
+    """
+
+    def __init__(self, prefix: str, append: bool = False, delta: bool = False,
+                 batch_rows: int = PARQUET_BATCH_ROWS):
+        if pa is None:
+            raise ImportError("Parquet output needs pyarrow, install it with pip install pyarrow")
+
+        timestamp = pa.timestamp("ns", tz="UTC")
+        self._outputs = {
+            'details': (normalize_details, pa.schema([
+                ('business_ref', pa.string()), ('business_name', pa.string()), ('address', pa.string()),
+                ('avg_rating', pa.float32()), ('total_reviews', pa.int64()), ('service_options', pa.string()),
+                ('scraped_at', timestamp)])),
+            'popular_times': (normalize_popular_times, pa.schema([
+                ('business_ref', pa.string()), ('percent_busy', pa.float32()), ('hour_no', pa.int8()),
+                ('each_hour', pa.string()), ('day_of_week', pa.string()), ('scraped_at', timestamp)])),
+            'reviews': (normalize_reviews, pa.schema([
+                ('business_ref', pa.string()), ('reviewer_name', pa.string()), ('rating', pa.float32()),
+                ('reviewed_dt', pa.string()), ('reviewed_at', timestamp), ('review', pa.string()),
+                ('scraped_at', timestamp)])),
+        }
+        if delta:
+            self._outputs['review_delta'] = (normalize_review_delta, pa.schema([
+                ('business_ref', pa.string()), ('new_reviews', pa.int64()), ('reviews_edited', pa.bool_()),
+                ('scraped_at', timestamp)]))
+
+        self._columns = {'details': DETAILS_COLUMNS, 'popular_times': POPULAR_TIMES_COLUMNS, 'reviews': REVIEW_COLUMNS,
+                         'review_delta': REVIEW_DELTA_COLUMNS}
+        self._batch_rows = batch_rows
+        self._directories = {}
+        self._parts = {}
+        for name in self._outputs:
+            runs = sorted(glob.glob(os.path.join(glob.escape(f"{prefix}_{name}"), "run=*")))
+            directory = runs[-1] if append and runs else os.path.join(f"{prefix}_{name}",
+                                                                      f"run={strftime('%Y%m%dT%H%M%S', gmtime())}")
+            os.makedirs(directory, exist_ok=True)
+            self._directories[name] = directory
+            self._parts[name] = len(glob.glob(os.path.join(glob.escape(directory), "part-*.parquet")))
+        self._pending = {name: [] for name in self._outputs}
+        self._pending_rows = {name: 0 for name in self._outputs}
+        self._on_written = []
+        self.rows_written = {name: 0 for name in self._outputs}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, business_details: pd.DataFrame, popular_times: pd.DataFrame, reviews: pd.DataFrame,
+              review_delta: pd.DataFrame = None, scraped_at: float = None, on_written=None):
+        """
+        Adds one business's results, any of which may be None. scraped_at (epoch seconds) defaults to now.
+        on_written is called once the batch holding the rows has been written.
+        """
+        scraped_at = pd.Timestamp.now(tz="UTC") if scraped_at is None else pd.Timestamp(scraped_at, unit="s", tz="UTC")
+        for name, data in (('details', business_details), ('popular_times', popular_times), ('reviews', reviews),
+                           ('review_delta', review_delta)):
+            if data is None or data.empty or name not in self._outputs:
+                continue
+
+            self._pending[name].append(data.assign(scraped_at=scraped_at))
+            self._pending_rows[name] += len(data)
+        if on_written is not None:
+            self._on_written.append(on_written)
+        if max(self._pending_rows.values()) >= self._batch_rows:
+            self.flush()
+
+    def flush(self):
+        """ Writes every waiting row, then tells the businesses they belong to """
+        for name in self._outputs:
+            self._write_part(name)
+        on_written, self._on_written = self._on_written, []
+        for callback in on_written:
+            callback()
+
+    def close(self):
+        self.flush()
+
+    def _write_part(self, name: str):
+        if not self._pending[name]:
+            return
+
+        normalize, schema = self._outputs[name]
+        batch = pd.concat(self._pending[name], ignore_index=True)
+        batch = normalize(batch.reindex(columns=self._columns[name] + ['scraped_at']))
+        table = pa.Table.from_pandas(batch.reindex(columns=schema.names), schema=schema, preserve_index=False)
+        filename = os.path.join(self._directories[name], f"part-{self._parts[name]:05d}.parquet")
+        # Written under a temporary name so readers never see half a file
+        pq.write_table(table, filename + ".tmp")
+        os.replace(filename + ".tmp", filename)
+
+        self._parts[name] += 1
+        self.rows_written[name] += len(batch)
+        self._pending[name] = []
+        self._pending_rows[name] = 0
+
+
+def open_output(output_format: str, prefix: str, append: bool = False, delta: bool = False):
+    """ Returns the writer for an output format, one of OUTPUT_FORMATS """
+    if output_format == 'parquet':
+        return ParquetOutput(prefix, append=append, delta=delta)
+    return CsvOutput(prefix, append=append, delta=delta)
+
+
+def merge_parts(prefix: str, completed_by: dict) -> dict:
+    """
+    Combines the part outputs written by worker processes (see worker.py) into the standard
+    [prefix]_details, _popular_times and _reviews CSVs. Only the rows of the worker that completed
+    each business are kept, so a business scraped twice after an expired lease is not duplicated.
+    Returns the number of rows merged into each output.
+    """
+
+    rows_written = {}
+    for name, columns in (('details', DETAILS_COLUMNS), ('popular_times', POPULAR_TIMES_COLUMNS),
+                          ('reviews', REVIEW_COLUMNS)):
+        rows_written[name] = 0
+        with open(f"{prefix}_{name}.csv", "w", newline="", encoding="utf-8") as merged:
+            pd.DataFrame(columns=columns).to_csv(merged, index=False)
+            for part in sorted(glob.glob(f"{glob.escape(prefix)}.part-*_{name}.csv")):
+                worker = part[len(f"{prefix}.part-"):-len(f"_{name}.csv")]
+                for chunk in pd.read_csv(part, dtype=str, keep_default_na=False, chunksize=10000):
+                    chunk = chunk[chunk['business_ref'].map(completed_by.get) == worker]
+                    chunk.reindex(columns=columns).to_csv(merged, header=False, index=False)
+                    rows_written[name] += len(chunk)
+    return rows_written
@@ -0,0 +1,200 @@
+import logging
+import os
+import re
+
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+from lxml import html as lxml_html
+from lxml.etree import XPath
+
+from gmaps.exceptions import ParseError
+from gmaps.logs import CONSOLE
+
+REVIEW_ITEM_SELECTOR = 'div.jftiEf.fontBodyMedium'
+REVIEW_COLUMNS = ['business_ref', 'reviewer_name', 'rating', 'reviewed_dt', 'review']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+load_dotenv()  # take environment variables from .env.
+
+# Same level as gmaps.business, left to the root logger only errors would be logged
+if str(os.environ.get('G_MAPS_LOG_DEBUG', "false")).upper() == "TRUE":
+    log_level = logging.DEBUG
+else:
+    log_level = logging.INFO
+
+logger = logging.getLogger("gmaps.parse")
+logger.setLevel(log_level)
+
+
+def _has_class(tag: str, *class_names: str, path: str = './/') -> XPath:
+    """ Compiles an XPath matching tags carrying every class name, like a CSS class selector """
+    tests = "".join(f'[contains(concat(" ", normalize-space(@class), " "), " {name} ")]' for name in class_names)
+    return XPath(f"{path}{tag}{tests}")
+
+
+_REVIEW_ITEMS = _has_class('div', 'jftiEf', 'fontBodyMedium', path='//')
+_REVIEWER_NAME = _has_class('div', 'd4r55')
+_RATING = _has_class('span', 'kvMYJc')
+_REVIEWED_DT = _has_class('span', 'rsqaWe')
+_REVIEW_TEXT = _has_class('span', 'wiI7pd')
+_HOUR_BARS = _has_class('div', 'dpoVLd')
+_NAME_HEADING = XPath(".//h1")
+_ADDRESS_BUTTON = XPath(".//button[contains(@aria-label, 'Address')]")
+_RATING_IMAGE = XPath(f"{_has_class('div', 'F7nice').path}//span[contains(@role, 'img')]")
+_REVIEW_TOTAL = XPath(".//span[contains(@aria-label, 'reviews')]")
+_SERVICE_OPTIONS = _has_class('*', 'LTs0Rc')
+
+
+def new_review_dict() -> dict:
+    """ Returns an empty review dictionary with the review output columns """
+    return {column: [] for column in REVIEW_COLUMNS}
+
+
+def parse_review_feed(html: str, ref: str, rev_dict: dict = None, review_ids: list = None) -> dict:
+    """
+    Parses every review item in a block of review feed HTML in a single lxml pass.
+    Rows are appended to rev_dict when one is supplied so batches can be accumulated,
+    and the Google review id of each row to review_ids when that is supplied.
+    """
+
+    if rev_dict is None:
+        rev_dict = new_review_dict()
+    if not html or not html.strip():
+        return rev_dict
+
+    for item in _REVIEW_ITEMS(lxml_html.fromstring(html)):
+        try:
+            reviewer_name = _REVIEWER_NAME(item)[0].text_content().strip()
+            rating = _RATING(item)[0].attrib["aria-label"]
+            reviewed_dt = _REVIEWED_DT(item)[0].text_content()
+            review = _REVIEW_TEXT(item)
+            review = review[0].text_content() if review else ""
+        except (IndexError, KeyError):
+            logger.exception("Error getting review data", extra=CONSOLE)
+            continue
+
+        _append_review(rev_dict, ref, reviewer_name, rating, reviewed_dt, review)
+        if review_ids is not None:
+            review_ids.append(item.get("data-review-id", ""))
+    return rev_dict
+
+
+def parse_review_item(html_item: str, ref: str, rev_dict: dict = None) -> dict:
+    """
+    Parses the outerHTML of a single review item with its own BeautifulSoup tree.
+    This is the original per item path, kept to compare against parse_review_feed.
+    """
+
+    if rev_dict is None:
+        rev_dict = new_review_dict()
+
+    bs_item = BeautifulSoup(html_item, 'html.parser')
+    try:
+        reviewer_name = bs_item.find('div', class_='d4r55').text.strip()
+        rating = bs_item.find('span', class_='kvMYJc')["aria-label"]
+        reviewed_dt = bs_item.find('span', class_='rsqaWe').text
+        review = bs_item.find('span', class_='wiI7pd')
+        review = "" if review is None else review.text
+    except Exception:
+        logger.exception("Error getting review data", extra=CONSOLE)
+        return rev_dict
+
+    _append_review(rev_dict, ref, reviewer_name, rating, reviewed_dt, review)
+    return rev_dict
+
+
+def _append_review(rev_dict: dict, ref: str, reviewer_name: str, rating: str, reviewed_dt: str, review: str):
+    # Called for every review, so the record is only built when debug logging is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Reviewer %s", reviewer_name, extra=CONSOLE)
+    rev_dict['business_ref'].append(ref)
+    rev_dict['reviewer_name'].append(reviewer_name)
+    rev_dict['rating'].append(rating)
+    rev_dict['reviewed_dt'].append(reviewed_dt)
+    rev_dict['review'].append(review)
+
+
+def no_popular_times(ref: str) -> list:
+    """ Returns the single placeholder row written when a business has no popular times """
+    return [{'business_ref': ref, 'percent_busy': "none", 'hour_no': "none", 'each_hour': "none",
+             'day_of_week': "none"}]
+
+
+def parse_popular_times(html: str, ref: str) -> list:
+    """
+    Parses every day of the popular times histogram (the C7xf8b element) in one pass.
+    Each child of the histogram holds one day, named in its aria-label when available
+    and otherwise taken from its position.
+    """
+
+    popular_times = []
+    graph = lxml_html.fromstring(html)
+    for day_index, day_graph in enumerate(graph.iterchildren()):
+        day_label = day_graph.get("aria-label", "")
+        day = next((name for name in DAYS if name in day_label), DAYS[day_index % len(DAYS)])
+        logger.debug("[%s] Getting %s hours.", ref, day, extra=CONSOLE)
+
+        for each_hour in _HOUR_BARS(day_graph):
+            hour_label = each_hour.get("aria-label")
+            if hour_label is None:
+                continue
+
+            label_text = hour_label.split()
+            if label_text[0] != 'Currently':
+                popular_times.append({
+                    'business_ref': ref,
+                    'percent_busy': label_text[0].replace("%", ''),
+                    'hour_no': int(label_text[3]) if (
+                            label_text[4].upper() == "AM." or int(label_text[3]) == 12) else int(
+                        label_text[3]) + 12,
+                    'each_hour': hour_label,
+                    'day_of_week': day
+                })
+    return popular_times
+
+
+def parse_details(html: str, ref: str) -> dict:
+    """
+    Parses the summary fields of a business from the HTML of the place panel.
+    Missing fields fall back to "No Address", "No rating" and "0", a missing
+    business name raises ParseError.
+    """
+
+    panel = lxml_html.fromstring(html)
+
+    name_heading = _NAME_HEADING(panel)
+    if not name_heading:
+        raise ParseError(f"Unable to find the business name for {ref}")
+
+    address_button = _ADDRESS_BUTTON(panel)
+    if address_button and ":" in address_button[0].get("aria-label"):
+        address = address_button[0].get("aria-label").split(":")[1].strip()
+    else:
+        logger.error(f"[{ref}] Unable to get address for {ref}", extra=CONSOLE)
+        address = "No Address"
+
+    rating_image = _RATING_IMAGE(panel)
+    if rating_image and rating_image[0].get("aria-label") is not None:
+        rating = rating_image[0].get("aria-label").strip()
+    else:
+        logger.error(f"[{ref}] Unable to get rating for {ref}", extra=CONSOLE)
+        rating = "No rating"
+
+    review_total = _REVIEW_TOTAL(panel)
+    if review_total:
+        review_total = re.sub('[()]', '', review_total[0].text_content().strip())
+    else:
+        logger.error(f"[{ref}] Unable to get review count", extra=CONSOLE)
+        review_total = "0"
+
+    service_options = [option.get("aria-label") for option in _SERVICE_OPTIONS(panel)
+                       if option.get("aria-label") is not None]
+
+    return {
+        'business_ref': ref,
+        'business_name': name_heading[0].text_content().strip(),
+        'address': address,
+        'avg_rating': rating,
+        'total_reviews': review_total,
+        'service_options': ", ".join(service_options),
+    }
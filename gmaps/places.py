@@ -0,0 +1,111 @@
+import os
+import re
+import sqlite3
+import threading
+from time import time
+
+from dotenv import load_dotenv
+
+load_dotenv()  # take environment variables from .env.
+
+# File the place cache is kept in, empty to always search
+PLACE_CACHE = str(os.environ.get('G_MAPS_PLACE_CACHE', "place-cache.sqlite"))
+PLACE_TTL_DAYS = float(os.environ.get('G_MAPS_PLACE_TTL_DAYS', 30))
+NO_MATCH_TTL_DAYS = float(os.environ.get('G_MAPS_PLACE_NO_MATCH_TTL_DAYS', 7))
+# Maximum number of queries remembered, the least recently used are evicted first
+PLACE_CACHE_SIZE = int(os.environ.get('G_MAPS_PLACE_CACHE_SIZE', 20000))
+# Searches in a row with no match before a search is remembered as having none, so one slow page is not enough
+NO_MATCH_CONFIRMATIONS = 2
+# Seconds between no matches for both to count, so the attempts of one run are only ever one confirmation
+NO_MATCH_CONFIRMATION_GAP = 3600
+
+# Returned by PlaceCache.lookup for a query Google maps is known not to match
+NO_MATCH = ""
+
+
+def normalize_query(address: str) -> str:
+    """ Returns the cache key for a search, ignoring case, punctuation and repeated spaces """
+    return " ".join(re.sub(r"[^\w\s]", " ", address.lower()).split())
+
+
+class PlaceCache:
+    """
+    Persistent record of the place page each search resolved to, so repeat runs open the place
+    directly instead of searching, and of the searches with no match, which are skipped until
+    they expire. Matches expire after ttl_days and no matches after no_match_ttl_days. A search
+    is only skipped once NO_MATCH_CONFIRMATIONS searches in a row, at least NO_MATCH_CONFIRMATION_GAP
+    apart, have found no match, so one bad spell in a run is never enough.
+
+    Lookups and updates come from the worker threads, so the connection is shared under a lock.
+    """
+
+    def __init__(self, filename: str = PLACE_CACHE, ttl_days: float = PLACE_TTL_DAYS,
+                 no_match_ttl_days: float = NO_MATCH_TTL_DAYS, size: int = PLACE_CACHE_SIZE):
+        self._ttl = ttl_days * 86400
+        self._no_match_ttl = no_match_ttl_days * 86400
+        self._size = size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.stats = {'hits': 0, 'no_match_hits': 0, 'misses': 0, 'stale': 0}
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS place ("
+                "query TEXT PRIMARY KEY, url TEXT, no_matches INTEGER NOT NULL DEFAULT 0, resolved REAL NOT NULL, "
+                "last_used REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS place_last_used ON place (last_used)")
+            self._expire()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def lookup(self, address: str) -> str:
+        """ Returns the place URL the search resolved to, NO_MATCH for a known no match, or None when not cached """
+        query = normalize_query(address)
+        now = time()
+        with self._lock, self._connection:
+            entry = self._connection.execute(
+                "SELECT url, resolved, no_matches FROM place WHERE query = ?", (query,)).fetchone()
+            if entry is None or now - entry[1] > (self._ttl if entry[0] else self._no_match_ttl) or \
+                    (not entry[0] and entry[2] < NO_MATCH_CONFIRMATIONS):
+                self.stats['misses'] += 1
+                return None
+
+            self._connection.execute("UPDATE place SET last_used = ? WHERE query = ?", (now, query))
+            self.stats['hits' if entry[0] else 'no_match_hits'] += 1
+            return entry[0] or NO_MATCH
+
+    def store(self, address: str, url: str):
+        """ Records the place URL a search resolved to, NO_MATCH when it had no match """
+        now = time()
+        with self._lock, self._connection:
+            # no_matches counts the searches in a row without a match, any match starts it again. A no match
+            # within the gap of the one already counted leaves the entry as it is.
+            self._connection.execute(
+                "INSERT INTO place (query, url, no_matches, resolved, last_used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(query) DO UPDATE SET url = excluded.url, last_used = excluded.last_used, "
+                "resolved = CASE WHEN excluded.url IS NULL AND url IS NULL AND excluded.resolved - resolved < ? "
+                "THEN resolved ELSE excluded.resolved END, "
+                "no_matches = CASE WHEN excluded.url IS NOT NULL OR url IS NOT NULL THEN excluded.no_matches "
+                "WHEN excluded.resolved - resolved < ? THEN no_matches ELSE no_matches + 1 END",
+                (normalize_query(address), url or None, 0 if url else 1, now, now, NO_MATCH_CONFIRMATION_GAP,
+                 NO_MATCH_CONFIRMATION_GAP))
+            self._connection.execute(
+                "DELETE FROM place WHERE query IN "
+                "(SELECT query FROM place ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self._size,))
+
+    def forget(self, address: str):
+        """ Drops a cached place URL that no longer opens the place """
+        with self._lock, self._connection:
+            self.stats['stale'] += 1
+            self._connection.execute("DELETE FROM place WHERE query = ?", (normalize_query(address),))
+
+    def close(self):
+        self._connection.close()
+
+    def _expire(self):
+        now = time()
+        self._connection.execute("DELETE FROM place WHERE (url IS NOT NULL AND resolved < ?) OR "
+                                 "(url IS NULL AND resolved < ?)", (now - self._ttl, now - self._no_match_ttl))
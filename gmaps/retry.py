@@ -0,0 +1,137 @@
+import csv
+import heapq
+import os
+import random
+from time import monotonic, time
+
+from dotenv import load_dotenv
+from selenium.common.exceptions import InvalidSessionIdException, TimeoutException, WebDriverException
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from gmaps.exceptions import BrowserError, EmptyBusinessError, FactoryError, FactoryTimeoutError, ParseError
+
+load_dotenv()  # take environment variables from .env.
+
+# Attempts per business, including the first, before a transient failure is given up on
+RETRY_ATTEMPTS = int(os.environ.get('G_MAPS_RETRY_ATTEMPTS', 3))
+# Seconds before the first retry, doubled for each retry after it up to RETRY_MAX_DELAY
+RETRY_BASE_DELAY = float(os.environ.get('G_MAPS_RETRY_BASE_DELAY', 30))
+RETRY_MAX_DELAY = float(os.environ.get('G_MAPS_RETRY_MAX_DELAY', 600))
+
+NO_MATCH = "no_match"
+TIMEOUT = "timeout"
+BROWSER_CRASH = "browser_crash"
+BROWSER_ERROR = "browser_error"
+PARSE_ERROR = "parse_error"
+OTHER = "other"
+# Failures worth trying again, a missing place or a page the extractors no longer understand will fail the same way
+TRANSIENT_FAILURES = {TIMEOUT, BROWSER_CRASH, BROWSER_ERROR}
+
+FAILURE_REPORT_COLUMNS = ['business_ref', 'attempt', 'failure', 'retry_in_seconds', 'error', 'failed_at']
+
+# Messages of WebDriverExceptions raised when the browser itself has gone
+_CRASH_MESSAGES = ("chrome not reachable", "session deleted", "disconnected", "target window already closed",
+                   "tab crashed", "no such window", "connection refused")
+
+
+def classify_failure(error: Exception) -> str:
+    """ Returns the failure class of an exception raised while scraping a business """
+
+    # The factory raises FactoryError when Google maps says a search has no match, and FactoryTimeoutError
+    # when the page showed neither a place nor a no match in time, which is worth another look
+    if isinstance(error, (FactoryTimeoutError, TimeoutException)):
+        return TIMEOUT
+    if isinstance(error, (FactoryError, EmptyBusinessError)):
+        return NO_MATCH
+    if isinstance(error, ParseError):
+        return PARSE_ERROR
+    if isinstance(error, BrowserError):
+        return BROWSER_ERROR
+    # A dead chromedriver is not a WebDriverException, selenium's HTTP client fails to reach it
+    if isinstance(error, (MaxRetryError, NewConnectionError, ProtocolError, ConnectionError)):
+        return BROWSER_CRASH
+    if isinstance(error, InvalidSessionIdException) or (
+            isinstance(error, WebDriverException) and any(message in str(error).lower()
+                                                          for message in _CRASH_MESSAGES)):
+        return BROWSER_CRASH
+    if isinstance(error, WebDriverException):
+        return BROWSER_ERROR
+    return OTHER
+
+
+class RetryQueue:
+    """
+    Targets waiting to be retried, ordered by when they are due. Nothing sleeps: the results loop
+    submits due retries when a worker is free and waits no longer than next_due_in for the next one.
+
+    The delay doubles with each attempt from base_delay up to max_delay, with jitter so targets that
+    failed together (for example while Google was throttling) are not all retried at once.
+    """
+
+    def __init__(self, attempts: int = RETRY_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._waiting = []
+        self._sequence = 0
+        self.scheduled = 0
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def schedule(self, target: str, attempt: int, failure: str) -> float:
+        """ Queues a failed target for another attempt, returning the delay, or None when it should not be retried """
+        if failure not in TRANSIENT_FAILURES or attempt >= self.attempts:
+            return None
+
+        # Equal jitter, half the backoff plus a random share of the other half
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+        self._sequence += 1
+        heapq.heappush(self._waiting, (monotonic() + delay, self._sequence, target, attempt + 1))
+        self.scheduled += 1
+        return delay
+
+    def pop_due(self) -> tuple:
+        """ Returns the next (target, attempt) whose delay has passed, or None """
+        if self._waiting and self._waiting[0][0] <= monotonic():
+            _, _, target, attempt = heapq.heappop(self._waiting)
+            return target, attempt
+        return None
+
+    def next_due_in(self) -> float:
+        """ Seconds until the next retry is due, None when nothing is waiting """
+        if not self._waiting:
+            return None
+        return max(0.0, self._waiting[0][0] - monotonic())
+
+    def targets(self) -> list:
+        return [target for _, _, target, _ in self._waiting]
+
+
+class FailureReport:
+    """ CSV of every failed attempt with its failure class, and counts of the failures given up on """
+
+    def __init__(self, filename: str, append: bool = False):
+        self._file = open(filename, "a" if append else "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._writer.writerow(FAILURE_REPORT_COLUMNS)
+        self.final_failures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, ref: str, attempt: int, failure: str, error: Exception, retry_in: float = None):
+        self._writer.writerow([ref, attempt, failure, "" if retry_in is None else round(retry_in, 1),
+                               f"{type(error).__name__}: {error}".strip(), round(time(), 3)])
+        self._file.flush()
+        if retry_in is None:
+            self.final_failures[failure] = self.final_failures.get(failure, 0) + 1
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,149 @@
+import os
+from time import monotonic
+
+from dotenv import load_dotenv
+
+from gmaps.business import log_debug, log_info
+from gmaps.metrics import percentile
+
+load_dotenv()  # take environment variables from .env.
+
+# Seconds between scaling decisions
+SCALE_INTERVAL = float(os.environ.get('G_MAPS_SCALE_INTERVAL', 20))
+# Host CPU use (percent) above which a browser is removed, a browser is only added below three quarters of it
+SCALE_MAX_CPU = float(os.environ.get('G_MAPS_SCALE_MAX_CPU', 90))
+# Free memory (MB) needed to add a browser, a browser is removed when less than half of it is free
+SCALE_MIN_MEMORY_MB = int(os.environ.get('G_MAPS_SCALE_MIN_MEMORY_MB', 1024))
+# Share of failed or timed out businesses above which the worker count is halved
+SCALE_MAX_ERROR_RATE = float(os.environ.get('G_MAPS_SCALE_MAX_ERROR_RATE', 0.25))
+# How far the median time per business, without review scrolling and parsing, may rise above the best median seen
+# before a browser is removed
+SCALE_LATENCY_FACTOR = float(os.environ.get('G_MAPS_SCALE_LATENCY_FACTOR', 1.5))
+
+
+class AdaptiveScheduler:
+    """
+    Decides how many browser workers should be live, between min_workers and max_workers.
+
+    Every interval the businesses finished since the last decision are compared with the host's
+    CPU and memory headroom. Errors (usually throttling) halve the workers, an overloaded host or
+    a median time per business well above the best seen removes one, and spare headroom with
+    healthy results adds one. The time recorded leaves out review scrolling and parsing (see
+    BusinessMetrics.seconds_without_reviews), which depend on how many reviews a business has
+    rather than on the load. Only the results loop calls record and adjust.
+    """
+
+    def __init__(self, min_workers: int, max_workers: int, interval: float = SCALE_INTERVAL):
+        self.min_workers = max(1, min(min_workers, max_workers))
+        self.max_workers = max(1, max_workers)
+        self.workers = self.min_workers
+        self.interval = interval
+        self.decisions = 0
+        self._finished = 0
+        self._latencies = []
+        self._failures = 0
+        self._best_latency = None
+        self._last_decision = monotonic()
+        self._cpu_times = host_cpu_times()
+
+    def record(self, seconds: float, failed: bool):
+        """ Adds a finished business to the current decision window, only successes count towards the median """
+        self._finished += 1
+        if failed:
+            self._failures += 1
+        else:
+            self._latencies.append(seconds)
+
+    def adjust(self) -> bool:
+        """ Makes a scaling decision once the interval has passed, returns True when the worker count changed """
+        if monotonic() - self._last_decision < self.interval:
+            return False
+
+        cpu = self._cpu_percent()
+        memory = available_memory_mb()
+        finished = self._finished
+        error_rate = self._failures / finished if finished else 0.0
+        latency = percentile(sorted(self._latencies), 50)
+        if latency is not None and len(self._latencies) >= self.workers:
+            self._best_latency = latency if self._best_latency is None else min(self._best_latency, latency)
+
+        workers, reason = self._decide(cpu, memory, finished, error_rate, latency)
+        workers = max(self.min_workers, min(self.max_workers, workers))
+        observed = (f"cpu {'n/a' if cpu is None else f'{round(cpu)}%'}, "
+                    f"free memory {'n/a' if memory is None else f'{memory} MB'}, {finished} finished, "
+                    f"error rate {round(error_rate * 100)}%, "
+                    f"median {'n/a' if latency is None else f'{round(latency, 1)}s'}")
+
+        changed = workers != self.workers
+        if changed:
+            log_info(f"Scaling browser workers from {self.workers} to {workers}: {reason} ({observed})")
+            self.workers = workers
+            self.decisions += 1
+        else:
+            log_debug(f"Keeping {self.workers} browser workers: {reason} ({observed})")
+
+        self._finished = 0
+        self._latencies = []
+        self._failures = 0
+        self._last_decision = monotonic()
+        return changed
+
+    def _decide(self, cpu: float, memory: int, finished: int, error_rate: float, latency: float) -> tuple:
+        # Too little to go on yet, a single failure out of two would otherwise halve the workers
+        if finished >= 4 and error_rate > SCALE_MAX_ERROR_RATE:
+            return self.workers // 2, "error rate too high"
+        if cpu is not None and cpu > SCALE_MAX_CPU:
+            return self.workers - 1, "host CPU overloaded"
+        if memory is not None and memory < SCALE_MIN_MEMORY_MB / 2:
+            return self.workers - 1, "host memory low"
+        if latency is not None and self._best_latency and latency > self._best_latency * SCALE_LATENCY_FACTOR:
+            return self.workers - 1, "time per business rising"
+
+        if self.workers >= self.max_workers:
+            return self.workers, "at the maximum"
+        if cpu is not None and cpu > SCALE_MAX_CPU * 0.75:
+            return self.workers, "no CPU headroom"
+        if memory is not None and memory < SCALE_MIN_MEMORY_MB:
+            return self.workers, "no memory headroom"
+        if finished == 0:
+            return self.workers, "no businesses finished"
+        return self.workers + 1, "spare headroom"
+
+    def _cpu_percent(self) -> float:
+        """ Host CPU use since the last decision, None when it cannot be read on this platform """
+        cpu_times = host_cpu_times()
+        previous, self._cpu_times = self._cpu_times, cpu_times
+        if cpu_times is None or previous is None:
+            return None
+        busy = cpu_times[0] - previous[0]
+        total = cpu_times[1] - previous[1]
+        return 100 * busy / total if total > 0 else None
+
+
+def host_cpu_times() -> tuple:
+    """ Returns the (busy, total) CPU time of the host from /proc/stat, or None when it is unavailable """
+    try:
+        with open("/proc/stat", encoding="utf-8") as stat:
+            fields = [int(value) for value in stat.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+
+    # idle and iowait are the fourth and fifth fields
+    idle = sum(fields[3:5])
+    return sum(fields) - idle, sum(fields)
+
+
+def available_memory_mb() -> int:
+    """ Returns the memory available to new processes in MB, or None when it is unavailable """
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 1048576
+    except (AttributeError, ValueError, OSError):
+        return None
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service as ChromeService
+
+from gmaps import metrics
+from gmaps.business import GOOGLE_MAPS_URL, get_options, log_debug, log_exception
+from gmaps.exceptions import BrowserError
+
+load_dotenv()  # take environment variables from .env.
+
+SESSION_MAX_USES = int(os.environ.get('G_MAPS_SESSION_MAX_USES', 25))
+GOOGLE_ORIGIN = "{0.scheme}://{0.netloc}".format(urlsplit(GOOGLE_MAPS_URL))
+
+# URL patterns blocked by each resource blocking profile, none of these are used by the extractors
+BLOCK_PROFILES = {
+    'none': [],
+    'standard': [
+        # map tiles, satellite imagery and street view
+        "*/maps/vt*", "*/maps/vt/*", "*khms*.google.com/*", "*streetviewpixels-pa.googleapis.com/*",
+        # business photos, avatars and static images
+        "*.googleusercontent.com/*", "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.ico",
+        # video and audio
+        "*.mp4", "*.webm", "*.m4a", "*.mp3",
+        # web fonts
+        "*fonts.gstatic.com/*", "*.woff", "*.woff2", "*.ttf",
+    ],
+}
+BLOCK_PROFILES['strict'] = BLOCK_PROFILES['standard'] + [
+    # logging and tracking beacons
+    "*/gen_204*", "*/log?*", "*/maps/preview/log204*", "*google-analytics.com/*", "*googletagmanager.com/*",
+    "*doubleclick.net/*", "*play.google.com/log*",
+]
+BLOCK_PROFILE = str(os.environ.get('G_MAPS_BLOCK_PROFILE', "standard")).lower()
+BLOCK_PATTERNS = [pattern.strip() for pattern in str(os.environ.get('G_MAPS_BLOCK_PATTERNS', "")).split(",")
+                  if pattern.strip()]
+
+
+class SessionPool:
+    """
+    Bounded pool of warm headless Chrome sessions shared by the worker threads.
+
+    Sessions are started lazily, reset between targets and recycled after
+    max_uses checkouts or as soon as they stop responding.
+    """
+
+    def __init__(self, driver_path: str, size: int, max_uses: int = SESSION_MAX_USES):
+        check_block_profile(BLOCK_PROFILE)
+        self._driver_path = driver_path
+        self._size = size
+        self._max_uses = max_uses
+        self._idle = []
+        self._uses = {}
+        self._live = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self.stats = {'started': 0, 'reused': 0, 'recycled': 0, 'crashed': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextmanager
+    def session(self):
+        """ Checks a session out of the pool and returns it once the caller is finished with it """
+        with metrics.phase('browser'):
+            chrome_driver = self._checkout()
+        try:
+            yield chrome_driver
+        finally:
+            self._release(chrome_driver)
+
+    def resize(self, size: int):
+        """ Changes the number of live sessions allowed, sessions over the new size are quit once idle """
+        with self._condition:
+            self._size = size
+            surplus = max(0, self._live - size)
+            idle, self._idle = self._idle[:surplus], self._idle[surplus:]
+            self._condition.notify_all()
+
+        for chrome_driver in idle:
+            self._discard(chrome_driver)
+
+    def close(self):
+        """ Quits every idle session, sessions still checked out are quit when they are returned """
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+
+        for chrome_driver in idle:
+            self._discard(chrome_driver)
+
+    def _checkout(self) -> webdriver.Chrome:
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise BrowserError("Unable to check out a browser session from a closed pool")
+                if self._idle:
+                    # LIFO so the most recently used, warmest session is handed out first
+                    self.stats['reused'] += 1
+                    return self._idle.pop()
+                if self._live < self._size:
+                    self._live += 1
+                    break
+                self._condition.wait()
+
+        # Start the browser outside the lock so several sessions can warm up at once
+        try:
+            chrome_driver = webdriver.Chrome(service=ChromeService(self._driver_path), options=get_options())
+        except Exception:
+            with self._condition:
+                self._live -= 1
+                self._condition.notify()
+            raise
+
+        try:
+            count_round_trips(chrome_driver)
+            block_resources(chrome_driver)
+        except Exception:
+            # Quit the browser and give the slot back, a retry would otherwise leak another one
+            self._discard(chrome_driver)
+            raise
+        with self._condition:
+            self.stats['started'] += 1
+        metrics.current().browser_started = True
+        log_debug(f"Started browser session {chrome_driver.session_id}")
+        return chrome_driver
+
+    def _release(self, chrome_driver: webdriver.Chrome):
+        uses = self._uses.get(chrome_driver, 0) + 1
+        self._uses[chrome_driver] = uses
+
+        if uses >= self._max_uses:
+            log_debug(f"Recycling browser session {chrome_driver.session_id} after {uses} uses")
+            with self._condition:
+                self.stats['recycled'] += 1
+            self._discard(chrome_driver)
+            return
+
+        try:
+            reset_session(chrome_driver)
+        except Exception:
+            # A dead chromedriver raises urllib3 connection errors rather than WebDriverException
+            log_exception(f"Browser session {chrome_driver.session_id} stopped responding, discarding it")
+            with self._condition:
+                self.stats['crashed'] += 1
+            self._discard(chrome_driver)
+            return
+
+        with self._condition:
+            if not self._closed and self._live <= self._size:
+                self._idle.append(chrome_driver)
+                self._condition.notify()
+                return
+        self._discard(chrome_driver)
+
+    def _discard(self, chrome_driver: webdriver.Chrome):
+        try:
+            chrome_driver.quit()
+        except Exception:
+            log_exception("Error whilst quitting browser session")
+
+        with self._condition:
+            self._uses.pop(chrome_driver, None)
+            self._live -= 1
+            self._condition.notify()
+
+
+def count_round_trips(chrome_driver: webdriver.Chrome):
+    """ Wraps the session's command executor so every WebDriver round-trip is counted in round_trips """
+
+    execute = chrome_driver.execute
+
+    def counted_execute(driver_command, params=None):
+        chrome_driver.round_trips += 1
+        return execute(driver_command, params)
+
+    chrome_driver.round_trips = 0
+    chrome_driver.execute = counted_execute
+
+
+def block_resources(chrome_driver: webdriver.Chrome, profile: str = BLOCK_PROFILE, patterns: list = None):
+    """ Blocks the URL patterns of the resource blocking profile, plus any configured patterns, for the session """
+
+    check_block_profile(profile)
+    blocked_urls = BLOCK_PROFILES[profile] + (BLOCK_PATTERNS if patterns is None else patterns)
+    chrome_driver.execute_cdp_cmd("Network.enable", {})
+    chrome_driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls})
+
+
+def check_block_profile(profile: str):
+    """ Raises BrowserError for an unknown resource blocking profile, SessionPool checks the configured one up front """
+    if profile not in BLOCK_PROFILES:
+        raise BrowserError(f"Unknown resource blocking profile {profile}, expected one of {', '.join(BLOCK_PROFILES)}")
+
+
+def network_usage(chrome_driver: webdriver.Chrome) -> dict:
+    """
+    Drains the session's performance log and totals the requests made, bytes transferred and
+    requests blocked (by resource type) since the log was last read.
+    """
+
+    usage = {'requests': 0, 'bytes': 0, 'blocked': 0, 'blocked_types': {}}
+    request_types = {}
+    for entry in chrome_driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        method = message.get("method")
+        params = message.get("params", {})
+
+        if method == "Network.requestWillBeSent":
+            usage['requests'] += 1
+            request_types[params.get("requestId")] = params.get("type", "Other")
+        elif method == "Network.loadingFinished":
+            usage['bytes'] += int(params.get("encodedDataLength", 0))
+        elif method == "Network.loadingFailed" and params.get("blockedReason"):
+            resource_type = request_types.get(params.get("requestId"), params.get("type", "Other"))
+            usage['blocked'] += 1
+            usage['blocked_types'][resource_type] = usage['blocked_types'].get(resource_type, 0) + 1
+    return usage
+
+
+def reset_session(chrome_driver: webdriver.Chrome):
+    """
+    Returns a session to a blank state so the next target starts clean,
+    clearing cookies (including the consent cookies) and site storage.
+    """
+
+    chrome_driver.get("about:blank")
+    chrome_driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    chrome_driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": GOOGLE_ORIGIN, "storageTypes": "all"})
+    # Discard anything logged since the last target so its network usage is not counted against the next one
+    chrome_driver.get_log("performance")
@@ -1,38 +1,55 @@
+import argparse
 import concurrent.futures
 import logging.handlers
+import multiprocessing
 import os
-import sys
 from concurrent.futures import ThreadPoolExecutor
-from time import gmtime, time
+from time import gmtime, perf_counter, sleep, time
 
 import pandas as pd
 from dotenv import load_dotenv
 from webdriver_manager.chrome import ChromeDriverManager
 
+from gmaps.archive import write_archive
 from gmaps.business import business_factory
+from gmaps.checkpoint import Checkpoint
+from gmaps.delta import ReviewFingerprints
+from gmaps.logs import CONSOLE, start_logging
+from gmaps.metrics import BusinessMetrics, MetricsWriter, phase, track
+from gmaps.output import OUTPUT_FORMATS, CsvOutput, open_output
+from gmaps.places import PLACE_CACHE, PlaceCache
+from gmaps.retry import OTHER, TIMEOUT, TRANSIENT_FAILURES, FailureReport, RetryQueue, classify_failure
+from gmaps.scheduler import AdaptiveScheduler
+from gmaps.session import SessionPool, network_usage
 
 load_dotenv()  # take environment variables from .env.
 
 MAX_THREADS = int(os.environ['G_MAP_THREADS'])
+# The scheduler starts with this many browser workers and scales up to G_MAP_THREADS as the host allows
+MIN_THREADS = int(os.environ.get('G_MAP_THREADS_MIN', 1))
 LOG_NAME = str(os.environ['G_MAPS_LOG_NAME'])
+if multiprocessing.parent_process() is not None:
+    # A worker process started by worker.py run --processes, processes rotating one file would lose lines
+    log_root, log_extension = os.path.splitext(LOG_NAME)
+    LOG_NAME = f"{log_root}.worker-{os.getpid()}{log_extension}"
 LOG_MAX_SIZE = int(os.environ['G_MAPS_LOG_SIZE'])
 LOG_COUNT = int(os.environ['G_MAPS_LOG_COUNT'])
 APP_NAME = "google.business.scrape"
 
-# Configure logging
+# Configure logging, the file and the terminal are written by a background listener so the workers never block on them
 handler = logging.handlers.RotatingFileHandler(LOG_NAME,
                                                maxBytes=LOG_MAX_SIZE,
                                                backupCount=LOG_COUNT,
                                                encoding="utf-8")
 
 formatter = logging.Formatter(
-    '%(asctime)s %(pathname)s %(name)-15s [%(process)s] [%(thread)d] [%(levelname)s] %(message)s')
+    '%(asctime)s %(pathname)s %(name)-15s [%(process)s] [%(thread)d] [%(levelname)s] '
+    '[%(business_ref)s] [%(phase)s] %(message)s')
 formatter.converter = gmtime
 handler.setFormatter(formatter)
 
 # set the root logger level to error
-logging.basicConfig(handlers=[handler],
-                    level=logging.ERROR)
+start_logging(handler, level=logging.ERROR)
 
 logger = logging.getLogger(APP_NAME)
 
@@ -47,65 +64,230 @@ else:
 logger.setLevel(log_level)
 
 
-def scrape_business(business_details: str, driver_path: str):
+def scrape_business(business_details: str, session_pool: SessionPool, fingerprints: ReviewFingerprints = None,
+                    metrics_writer: MetricsWriter = None, archive_dir: str = None,
+                    place_cache: PlaceCache = None, paced_seconds: dict = None):
+    """
+    Scrapes one business from a "ref,address" input line. When paced_seconds is given, the time a
+    successful scrape took without its reviews (see BusinessMetrics.seconds_without_reviews) is
+    stored in it under the ref for the scheduler.
+    """
     ref, address = business_details.split(",")
 
     logger.debug(f"Scrape: {ref} - {address}")
     if ref and address:
+        business_metrics = None
         try:
-            google_business = business_factory(ref, address, driver_path)
-            return_details = pd.DataFrame(google_business.get_details(), index=[0])
-            return_times = pd.DataFrame(google_business.get_popular_times())
-            return_reviews = pd.DataFrame(google_business.get_reviews())
-            return return_details, return_times, return_reviews
+            with track(ref) as business_metrics, session_pool.session() as chrome_driver:
+                business_metrics.attach(chrome_driver)
+                try:
+                    return collect_business(ref, address, chrome_driver, fingerprints, business_metrics,
+                                            archive_dir, place_cache)
+                finally:
+                    # Stop counting before the pool resets the session
+                    business_metrics.detach()
         except Exception as e:
-            print(e)
-            logger.exception(e)
-            return None
+            logger.exception(e, extra=CONSOLE)
+            if business_metrics is not None:
+                business_metrics.failure = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if metrics_writer is not None and business_metrics is not None:
+                metrics_writer.write(business_metrics)
+            if paced_seconds is not None and business_metrics is not None and business_metrics.failure is None:
+                paced_seconds[ref] = business_metrics.seconds_without_reviews
     else:
         return None
 
 
-def main(input_filename: str, prefix: str):
+def collect_business(ref: str, address: str, chrome_driver, fingerprints: ReviewFingerprints,
+                     business_metrics: BusinessMetrics, archive_dir: str = None,
+                     place_cache: PlaceCache = None):
+    with phase('search'):
+        google_business = business_factory(ref, address, chrome_driver, place_cache)
+    known_reviews = fingerprints.known(ref) if fingerprints is not None else None
+    if archive_dir is not None:
+        google_business.raw_pages = {}
+    collected = google_business.collect(['details', 'popular_times', 'reviews'], known_reviews)
+    if archive_dir is not None:
+        with phase('archive'):
+            write_archive(archive_dir, ref, address, google_business.raw_pages, delta=known_reviews is not None)
+    return_details = pd.DataFrame(collected['details'], index=[0])
+    return_times = pd.DataFrame(collected['popular_times'])
+    return_reviews = pd.DataFrame(collected['reviews'])
+    if fingerprints is None:
+        return_delta = None
+    else:
+        return_delta = {'business_ref': ref,
+                        'new_reviews': len(return_reviews),
+                        'reviews_edited': google_business.reviews_edited,
+                        'review_total': google_business.review_total,
+                        'fingerprints': google_business.new_review_fingerprints}
+
+    business_metrics.reviews = len(return_reviews)
+    business_metrics.page_loads = google_business.page_loads
+    business_metrics.network = log_network_usage(ref, chrome_driver)
+    return return_details, return_times, return_reviews, return_delta
+
+
+def log_network_usage(ref: str, chrome_driver) -> dict:
+    try:
+        usage = network_usage(chrome_driver)
+    except Exception as e:
+        logger.exception(f"[{ref}] Unable to read network usage")
+        return None
+
+    blocked_types = ", ".join(f"{count} {resource_type}" for resource_type, count in usage['blocked_types'].items())
+    logger.info(f"[{ref}] Network: {usage['requests']} requests, {round(usage['bytes'] / 1024)} KB transferred, "
+                f"{usage['blocked']} requests blocked ({blocked_types or 'none'})")
+    return usage
+
+
+def main(input_filename: str, prefix: str, resume: bool = False, delta: bool = False, archive: str = None,
+         output_format: str = 'csv'):
     all_targets = read_file(input_filename)
     start_time = time()
-    all_details = []
-    all_times = []
-    all_reviews = []
+    if archive is not None:
+        os.makedirs(archive, exist_ok=True)
+
+    checkpoint = Checkpoint(f"{prefix}_checkpoint.sqlite", resume=resume)
+    if resume:
+        completed_refs = checkpoint.completed_refs()
+        all_targets = [target for target in all_targets if target.split(",")[0] not in completed_refs]
+        logger.info(f"Resuming run, skipping {len(completed_refs)} completed businesses, {len(all_targets)} remaining")
+        print(f"Resuming run, {len(all_targets)} businesses remaining")
 
     logger.info("Setting up chrome driver")
     print("Setting up chrome driver")
     chrome_driver_path = ChromeDriverManager().install()
 
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        results_futures = {executor.submit(scrape_business, target, chrome_driver_path): target for target in
-                           all_targets}
-        for future in concurrent.futures.as_completed(results_futures):
-            try:
-                data = future.result()
-                business_details, popular_times, reviews = data
-                if business_details is not None:
-                    all_details.append(business_details)
-                if popular_times is not None:
-                    all_times.append(popular_times)
-                if reviews is not None:
-                    all_reviews.append(reviews)
-            except Exception as e:
-                logger.exception(e)
-
-    output_details_pt = pd.concat(all_details, ignore_index=True)
-    output_times_pt = pd.concat(all_times, ignore_index=True)
-    output_reviews_pt = pd.concat(all_reviews, ignore_index=True)
-
-    output_details_pt.to_csv(f"{prefix}_details.csv", index=False)
-    output_times_pt.to_csv(f"{prefix}_popular_times.csv", index=False)
-    output_reviews_pt.to_csv(f"{prefix}_reviews.csv", index=False)
+    fingerprints = ReviewFingerprints() if delta else None
+    place_cache = PlaceCache() if PLACE_CACHE else None
+
+    scheduler = AdaptiveScheduler(MIN_THREADS, MAX_THREADS)
+    logger.info(f"Scaling between {scheduler.min_workers} and {scheduler.max_workers} browser workers")
+
+    retries = RetryQueue()
+    with checkpoint, \
+            open_output(output_format, prefix, append=resume, delta=delta) as output, \
+            MetricsWriter(f"{prefix}_metrics.jsonl", append=resume) as metrics_writer, \
+            FailureReport(f"{prefix}_failures.csv", append=resume) as failure_report, \
+            SessionPool(chrome_driver_path, scheduler.workers) as session_pool, \
+            ThreadPoolExecutor(max_workers=scheduler.max_workers) as executor:
+        pending_targets = iter(all_targets)
+        results_futures = {}
+        paced_seconds = {}
+        while True:
+            # Only keep as many businesses in flight as the scheduler allows, retries that are due go first
+            # and the rest wait in the input order
+            while len(results_futures) < scheduler.workers:
+                target, attempt = retries.pop_due() or (next(pending_targets, None), 1)
+                if target is None:
+                    break
+                future = executor.submit(scrape_business, target, session_pool, fingerprints, metrics_writer,
+                                         archive, place_cache, paced_seconds)
+                results_futures[future] = (target, attempt, perf_counter())
+            if not results_futures:
+                if not retries:
+                    break
+                # Only retries are left, wait here for the next one rather than in a worker
+                sleep(retries.next_due_in())
+                continue
+
+            timeout = min(scheduler.interval, retries.next_due_in()) if retries else scheduler.interval
+            done, _ = concurrent.futures.wait(results_futures, timeout=timeout,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                # Drop the future once handled so its results can be freed
+                target, attempt, submitted = results_futures.pop(future)
+                failure = record_result(future, target, attempt, output, checkpoint, fingerprints, retries,
+                                        failure_report)
+                # No matches and parse errors say nothing about the load on the host or on Google. The time
+                # without reviews is compared, so a window of businesses with many reviews does not look slow.
+                seconds = paced_seconds.pop(target.split(",")[0], perf_counter() - submitted)
+                scheduler.record(seconds, failure in TRANSIENT_FAILURES or failure == OTHER)
+
+            if scheduler.adjust():
+                session_pool.resize(scheduler.workers)
+
+        # Write any rows still batched so their businesses are checkpointed before the counts are read
+        output.flush()
+        checkpoint_counts = checkpoint.counts()
+
+    if fingerprints is not None:
+        fingerprints.close()
+    if place_cache is not None:
+        place_cache.close()
+        logger.info(f"Place cache: {place_cache.stats['hits']} places opened directly, "
+                    f"{place_cache.stats['no_match_hits']} known no matches skipped, {place_cache.stats['misses']} "
+                    f"searched, {place_cache.stats['stale']} cached places no longer opened")
+
+    final_failures = ", ".join(f"{count} {failure}" for failure, count in failure_report.final_failures.items())
+    logger.info(f"Retries: {retries.scheduled} scheduled, failed businesses by class: {final_failures or 'none'}")
+
+    session_stats = session_pool.stats
+    logger.info(f"Browser workers: {scheduler.workers} at the end of the run after {scheduler.decisions} scaling "
+                f"decisions")
+    logger.info(f"Browser sessions: {session_stats['started']} started, {session_stats['reused']} reused, "
+                f"{session_stats['recycled']} recycled, {session_stats['crashed']} crashed")
+    print(f"Browser sessions: {session_stats['started']} started, {session_stats['reused']} reused")
+    logger.info(f"Rows written: {output.rows_written['details']} details, "
+                f"{output.rows_written['popular_times']} popular times, {output.rows_written['reviews']} reviews")
+    logger.info(f"Businesses: {checkpoint_counts.get(Checkpoint.COMPLETED, 0)} completed, "
+                f"{checkpoint_counts.get(Checkpoint.FAILED, 0)} failed, "
+                f"{checkpoint_counts.get(Checkpoint.TIMEOUT, 0)} timed out")
+
+    summary = metrics_writer.summary()
+    for line in summary:
+        logger.info(f"Metrics: {line}")
+    print("\n".join(summary))
 
     end_time = time()
     elapsed_time = end_time - start_time
     logger.info(f"Elapsed run time: {round(elapsed_time / 60, 2)} minutes")
 
 
+def record_result(future, target: str, attempt: int, output: CsvOutput, checkpoint: Checkpoint,
+                  fingerprints: ReviewFingerprints, retries: RetryQueue, failure_report: FailureReport) -> str:
+    """
+    Writes a finished business's rows and records its outcome in the checkpoint. A transient failure
+    is queued to be retried instead of being recorded. Returns the failure class, None on success.
+    """
+    ref = target.split(",")[0]
+    try:
+        data = future.result()
+    except Exception as e:
+        failure = classify_failure(e)
+        retry_in = retries.schedule(target, attempt, failure)
+        failure_report.write(ref, attempt, failure, e, retry_in)
+        if retry_in is not None:
+            logger.info(f"[{ref}] Attempt {attempt} failed ({failure}), retrying in {round(retry_in)} seconds")
+            return failure
+        checkpoint.record(ref, Checkpoint.TIMEOUT if failure == TIMEOUT else Checkpoint.FAILED, f"{failure}: {e}")
+        return failure
+
+    if data is None:
+        checkpoint.record(ref, Checkpoint.FAILED, "Missing reference or address in the input file")
+        return OTHER
+
+    business_details, popular_times, reviews, review_delta = data
+
+    def completed():
+        # Only once the rows are on disk, a resumed run must not skip a business whose rows were lost
+        if review_delta is not None:
+            fingerprints.update(ref, review_delta['review_total'], review_delta['fingerprints'])
+        checkpoint.record(ref, Checkpoint.COMPLETED)
+
+    try:
+        output.write(business_details, popular_times, reviews,
+                     None if review_delta is None else pd.DataFrame([review_delta]), on_written=completed)
+    except Exception as e:
+        logger.exception(e)
+        checkpoint.record(ref, Checkpoint.FAILED, str(e))
+        return OTHER
+    return None
+
+
 def read_file(_filename: str) -> list:
     with open(_filename, newline='') as csvfile:
         all_lines = [stripped for line in csvfile if (stripped := line.strip())]
@@ -114,20 +296,31 @@ def read_file(_filename: str) -> list:
 
 if __name__ == '__main__':
 
-    if len(sys.argv) != 3:
-        print(sys.argv)
-        print(
-            'Enter the expected arguments <input.csv> <output file prefix>\n\nexample:\n\n python3 main.py target_details.csv 01_01_2023\n\n')
-        exit()
+    parser = argparse.ArgumentParser(
+        description="Scrape business details, popular times and reviews from Google maps",
+        epilog="example:\n\n python3 main.py target_details.csv 01_01_2023",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_csv", help="the input .csv of [Your Ref],[Business name + partial address]")
+    parser.add_argument("output_prefix", help="the prefix for the output files")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip businesses already completed by an interrupted run and append to its outputs")
+    parser.add_argument("--delta", action="store_true",
+                        help="only scrape reviews posted since the last run, see G_MAPS_DELTA_DB")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", dest="output_format",
+                        help="csv (default) or parquet, typed columns partitioned by run, needs pyarrow")
+    parser.add_argument("--archive", metavar="DIR",
+                        help="save the HTML each business is parsed from to DIR so reparse.py can parse it again")
+    args = parser.parse_args()
 
     try:
-        input_csv = sys.argv[1]
-        output_prefix = sys.argv[2]
+        input_csv = args.input_csv
+        output_prefix = args.output_prefix
 
         logger.info("==================== Google Business Scrape 3.0 ====================")
         logger.info(f"Input file: {input_csv}")
         logger.info(f"Output file prefix: {output_prefix}")
-        main(input_csv, output_prefix)
+        main(input_csv, output_prefix, resume=args.resume, delta=args.delta, archive=args.archive,
+             output_format=args.output_format)
 
     except Exception as e:
         print(e)
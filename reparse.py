@@ -0,0 +1,57 @@
+import argparse
+import concurrent.futures
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+
+import pandas as pd
+
+from gmaps.archive import reparse_archive
+from gmaps.output import OUTPUT_FORMATS, open_output
+
+
+def main(archive_dir: str, prefix: str, processes: int = None, output_format: str = 'csv'):
+    """
+    Parses every business archived by main.py --archive again, with no browser, and writes the
+    standard output files. Archives are parsed in a process pool so every core is used.
+    """
+
+    start_time = time()
+    archives = sorted(glob.glob(os.path.join(glob.escape(archive_dir), "*.json.gz")))
+    print(f"Parsing {len(archives)} archived businesses")
+
+    failed = 0
+    with open_output(output_format, prefix) as output, ProcessPoolExecutor(max_workers=processes) as executor:
+        results_futures = {executor.submit(reparse_archive, filename): filename for filename in archives}
+        for future in concurrent.futures.as_completed(results_futures):
+            filename = results_futures.pop(future)
+            try:
+                details, popular_times, reviews, scraped = future.result()
+            except Exception as e:
+                print(f"Unable to parse {filename}: {e}")
+                failed += 1
+                continue
+
+            output.write(pd.DataFrame([details]) if details else None, pd.DataFrame(popular_times),
+                         pd.DataFrame(reviews), scraped_at=scraped)
+
+    print(f"Rows written: {output.rows_written['details']} details, {output.rows_written['popular_times']} "
+          f"popular times, {output.rows_written['reviews']} reviews, {failed} archives failed")
+    print(f"Elapsed time: {round(time() - start_time, 1)} seconds")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description="Parse the pages saved by main.py --archive again without a browser",
+        epilog="example:\n\n python3 reparse.py archive/01_01_2023 01_01_2023_reparsed",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archive_dir", help="the directory passed to --archive")
+    parser.add_argument("output_prefix", help="the prefix for the output files")
+    parser.add_argument("--processes", type=int, help="parser processes, defaults to the number of CPUs")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", dest="output_format",
+                        help="csv (default) or parquet, see main.py --format")
+    args = parser.parse_args()
+
+    main(args.archive_dir, args.output_prefix, args.processes, args.output_format)
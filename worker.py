@@ -0,0 +1,189 @@
+import argparse
+import csv
+import concurrent.futures
+import glob
+import multiprocessing
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep, time
+
+from webdriver_manager.chrome import ChromeDriverManager
+
+from gmaps.jobs import JobQueue
+from gmaps.metrics import MetricsWriter
+from gmaps.output import CsvOutput, merge_parts
+from gmaps.places import PLACE_CACHE, PlaceCache
+from gmaps.retry import FAILURE_REPORT_COLUMNS, OTHER, TRANSIENT_FAILURES, FailureReport, RetryQueue
+from gmaps.scheduler import AdaptiveScheduler
+from gmaps.session import SessionPool
+from main import MAX_THREADS, MIN_THREADS, logger, read_file, record_result, scrape_business
+
+
+def enqueue(queue_filename: str, input_filename: str):
+    """ Adds the businesses in the input file to the job queue """
+    with JobQueue(queue_filename) as job_queue:
+        targets = read_file(input_filename)
+        added = job_queue.enqueue(targets)
+        counts = job_queue.counts()
+
+    logger.info(f"Queued {added} of {len(targets)} businesses from {input_filename}")
+    print(f"Queued {added} of {len(targets)} businesses, queue now holds {counts}")
+
+
+def run(queue_filename: str, prefix: str, processes: int = 1, archive: str = None):
+    """ Starts worker processes on this host and waits for the queue to be worked through """
+    if archive is not None:
+        os.makedirs(archive, exist_ok=True)
+    logger.info("Setting up chrome driver")
+    print("Setting up chrome driver")
+    chrome_driver_path = ChromeDriverManager().install()
+
+    if processes == 1:
+        run_worker(queue_filename, prefix, chrome_driver_path, archive)
+        return
+
+    # Spawned rather than forked, a forked child would inherit the log queue but not the thread listening to it
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(queue_filename, prefix, chrome_driver_path, archive))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        if worker.exitcode:
+            logger.error(f"Worker process {worker.pid} exited with code {worker.exitcode}")
+
+
+def run_worker(queue_filename: str, prefix: str, chrome_driver_path: str, archive: str = None):
+    """
+    Leases businesses from the queue and scrapes them until none are left, writing the rows
+    to part outputs of its own, [prefix].part-[worker id]_*.csv, that merge combines.
+    """
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    part_prefix = f"{prefix}.part-{worker_id}"
+    start_time = time()
+    scheduler = AdaptiveScheduler(MIN_THREADS, MAX_THREADS)
+    logger.info(f"Worker {worker_id} started, scaling between {scheduler.min_workers} and {scheduler.max_workers} "
+                f"browser workers")
+
+    place_cache = PlaceCache() if PLACE_CACHE else None
+    retries = RetryQueue()
+    with JobQueue(queue_filename, worker=worker_id) as job_queue, \
+            CsvOutput(part_prefix, append=True) as output, \
+            MetricsWriter(f"{part_prefix}_metrics.jsonl", append=True) as metrics_writer, \
+            FailureReport(f"{part_prefix}_failures.csv", append=True) as failure_report, \
+            SessionPool(chrome_driver_path, scheduler.workers) as session_pool, \
+            ThreadPoolExecutor(max_workers=scheduler.max_workers) as executor:
+        results_futures = {}
+        paced_seconds = {}
+        # Renew well inside the lease so a slow business is never handed to another worker
+        renew_interval = job_queue.lease_seconds / 3
+        last_renewal = monotonic()
+        while True:
+            while len(results_futures) < scheduler.workers:
+                # Retries keep their lease while they wait, so they go ahead of new businesses
+                retry = retries.pop_due()
+                if retry is not None:
+                    target, attempt = retry
+                else:
+                    job = job_queue.lease()
+                    if job is None:
+                        break
+                    target, attempt = job[1], 1
+                future = executor.submit(scrape_business, target, session_pool, None, metrics_writer, archive,
+                                         place_cache, paced_seconds)
+                results_futures[future] = (target, attempt, monotonic())
+            if not results_futures and not retries:
+                break
+
+            timeout = min(scheduler.interval, renew_interval)
+            if retries:
+                timeout = min(timeout, retries.next_due_in())
+            if results_futures:
+                done, _ = concurrent.futures.wait(results_futures, timeout=timeout,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+            else:
+                # Only retries are left, wait here for the next one rather than in a worker
+                sleep(timeout)
+                done = []
+            for future in done:
+                target, attempt, submitted = results_futures.pop(future)
+                failure = record_result(future, target, attempt, output, job_queue, None, retries, failure_report)
+                seconds = paced_seconds.pop(target.split(",")[0], monotonic() - submitted)
+                scheduler.record(seconds, failure in TRANSIENT_FAILURES or failure == OTHER)
+
+            if monotonic() - last_renewal > renew_interval:
+                waiting = [target for target, _, _ in results_futures.values()] + retries.targets()
+                job_queue.renew([target.split(",")[0] for target in waiting])
+                last_renewal = monotonic()
+            if scheduler.adjust():
+                session_pool.resize(scheduler.workers)
+
+    if place_cache is not None:
+        place_cache.close()
+    logger.info(f"Worker {worker_id} finished in {round((time() - start_time) / 60, 2)} minutes, rows written: "
+                f"{output.rows_written['details']} details, {output.rows_written['popular_times']} popular times, "
+                f"{output.rows_written['reviews']} reviews")
+
+
+def merge(queue_filename: str, prefix: str):
+    """ Combines every worker's part outputs into the standard outputs for the prefix """
+    with JobQueue(queue_filename) as job_queue:
+        completed_by = job_queue.completed_by()
+        counts = job_queue.counts()
+
+    rows_written = merge_parts(prefix, completed_by)
+
+    with open(f"{prefix}_metrics.jsonl", "w", encoding="utf-8") as merged:
+        for part in sorted(glob.glob(f"{glob.escape(prefix)}.part-*_metrics.jsonl")):
+            with open(part, encoding="utf-8") as metrics_part:
+                merged.writelines(metrics_part)
+
+    with open(f"{prefix}_failures.csv", "w", newline="", encoding="utf-8") as merged:
+        writer = csv.writer(merged)
+        writer.writerow(FAILURE_REPORT_COLUMNS)
+        for part in sorted(glob.glob(f"{glob.escape(prefix)}.part-*_failures.csv")):
+            with open(part, newline="", encoding="utf-8") as failures_part:
+                # Skip the part's own header row
+                writer.writerows(list(csv.reader(failures_part))[1:])
+
+    logger.info(f"Merged rows: {rows_written['details']} details, {rows_written['popular_times']} popular times, "
+                f"{rows_written['reviews']} reviews")
+    logger.info(f"Businesses: {counts}")
+    print(f"Merged {rows_written['details']} businesses, {rows_written['reviews']} reviews. Queue: {counts}")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description="Spread a scrape over worker processes on one or more hosts that share a job queue",
+        epilog="example:\n\n python3 worker.py enqueue jobs.sqlite target_details.csv\n"
+               " python3 worker.py run jobs.sqlite 01_01_2023 --processes 4\n"
+               " python3 worker.py merge jobs.sqlite 01_01_2023",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="add the businesses in an input file to the queue")
+    enqueue_parser.add_argument("queue", help="the job queue file, shared by every worker")
+    enqueue_parser.add_argument("input_csv", help="the input .csv of [Your Ref],[Business name + partial address]")
+
+    run_parser = commands.add_parser("run", help="scrape businesses from the queue until it is empty")
+    run_parser.add_argument("queue", help="the job queue file, shared by every worker")
+    run_parser.add_argument("output_prefix", help="the prefix for the output files")
+    run_parser.add_argument("--processes", type=int, default=1, help="worker processes to start on this host")
+    run_parser.add_argument("--archive", metavar="DIR",
+                            help="save the HTML each business is parsed from to DIR, see reparse.py")
+
+    merge_parser = commands.add_parser("merge", help="combine the workers' outputs into the standard output files")
+    merge_parser.add_argument("queue", help="the job queue file, shared by every worker")
+    merge_parser.add_argument("output_prefix", help="the prefix for the output files")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        enqueue(args.queue, args.input_csv)
+    elif args.command == "run":
+        run(args.queue, args.output_prefix, args.processes, args.archive)
+    else:
+        merge(args.queue, args.output_prefix)